@@ -0,0 +1,32 @@
+"""
+Helpers shared by the benchmark scripts: wall-clock timing and JSON reports.
+"""
+import json
+import time
+
+
+def timed(fn, inputs=None, repeats=1, sync=None):
+  """Milliseconds per pass of fn, averaged over repeats after one warm-up call.
+  A pass is fn(x) for every x of inputs, or a single fn() without inputs.
+  sync (e.g. torch.cuda.synchronize) is called before and after the timed
+  passes so that queued device work is counted."""
+  calls = [()] if inputs is None else [(x,) for x in inputs]
+  fn(*calls[0]) # warm up
+  if sync is not None:
+    sync()
+  start = time.perf_counter()
+  for _ in range(repeats):
+    for args in calls:
+      fn(*args)
+  if sync is not None:
+    sync()
+  return 1000. * (time.perf_counter() - start) / repeats
+
+
+def write_report(report, output=None):
+  """Writes report as indented JSON to output, or to stdout without one."""
+  if output is None:
+    print(json.dumps(report, indent=2))
+  else:
+    with open(output, "w") as f:
+      json.dump(report, f, indent=2)
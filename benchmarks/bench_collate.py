@@ -0,0 +1,95 @@
+"""
+TextAudioCollate (new_empty, one copy per row, only the padded tails zeroed)
+against the collate it replaced (zero_() of every padded field, then one
+slice copy and one length write per row), on random batches shaped like the
+training data. Both must return exactly the same tensors.
+
+  python benchmarks/bench_collate.py -c configs/tr_base.json --batch_size 64
+"""
+import os
+import sys
+import argparse
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils
+from data_utils import TextAudioCollate
+from _common import timed, write_report
+
+
+def baseline_collate(batch):
+  _, ids_sorted_decreasing = torch.sort(
+      torch.LongTensor([x[1].size(1) for x in batch]),
+      dim=0, descending=True)
+
+  max_text_len = max([len(x[0]) for x in batch])
+  max_spec_len = max([x[1].size(1) for x in batch])
+  max_wav_len = max([x[2].size(1) for x in batch])
+
+  text_lengths = torch.LongTensor(len(batch))
+  spec_lengths = torch.LongTensor(len(batch))
+  wav_lengths = torch.LongTensor(len(batch))
+
+  text_padded = torch.LongTensor(len(batch), max_text_len)
+  spec_padded = torch.FloatTensor(len(batch), batch[0][1].size(0), max_spec_len)
+  wav_padded = torch.FloatTensor(len(batch), 1, max_wav_len)
+  text_padded.zero_()
+  spec_padded.zero_()
+  wav_padded.zero_()
+  for i in range(len(ids_sorted_decreasing)):
+    row = batch[ids_sorted_decreasing[i]]
+
+    text = row[0]
+    text_padded[i, :text.size(0)] = text
+    text_lengths[i] = text.size(0)
+
+    spec = row[1]
+    spec_padded[i, :, :spec.size(1)] = spec
+    spec_lengths[i] = spec.size(1)
+
+    wav = row[2]
+    wav_padded[i, :, :wav.size(1)] = wav
+    wav_lengths[i] = wav.size(1)
+  return text_padded, text_lengths, spec_padded, spec_lengths, wav_padded, wav_lengths
+
+
+def random_batch(hps, batch_size, min_frames, max_frames):
+  batch = []
+  for _ in range(batch_size):
+    frames = int(torch.randint(min_frames, max_frames + 1, ()))
+    text = torch.randint(1, 100, (frames // 4 * 2 + 1,))
+    spec = torch.randn(hps.data.filter_length // 2 + 1, frames)
+    wav = torch.randn(1, frames * hps.data.hop_length)
+    batch.append((text, spec, wav))
+  return batch
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", default="configs/tr_base.json")
+  parser.add_argument("--batch_size", type=int, default=None, help="defaults to train.batch_size")
+  parser.add_argument("--min_frames", type=int, default=32)
+  parser.add_argument("--max_frames", type=int, default=1000)
+  parser.add_argument("--batches", type=int, default=20)
+  parser.add_argument("--output", default=None, help="JSON file, defaults to stdout")
+  args = parser.parse_args()
+
+  hps = utils.get_hparams_from_file(args.config)
+  b = args.batch_size or hps.train.batch_size
+  batches = [random_batch(hps, b, args.min_frames, args.max_frames) for _ in range(args.batches)]
+  collate = TextAudioCollate()
+
+  equal = all(torch.equal(out, ref) for batch in batches
+              for out, ref in zip(collate(batch), baseline_collate(batch)))
+  baseline_ms = timed(baseline_collate, batches) / len(batches)
+  collate_ms = timed(collate, batches) / len(batches)
+
+  report = {
+    "batch_size": b,
+    "frames": [args.min_frames, args.max_frames],
+    "equal": equal,
+    "baseline_ms": baseline_ms,
+    "collate_ms": collate_ms,
+    "speedup": baseline_ms / collate_ms,
+  }
+  write_report(report, args.output)
@@ -0,0 +1,58 @@
+"""
+Throughput of the Chinese text frontend: the merge_text path
+(remove_punctuation, convert_pinyin, cleaned_text_to_sequence, intersperse)
+against transition_engine/pinyin_frontend.PinyinFrontend, on every line of a
+text file. Both must produce the same ids for every line.
+
+  python benchmarks/bench_frontend.py audio_material/data/text/all.txt
+"""
+import os
+import sys
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "transition_engine"))
+import commons
+from text import cleaned_text_to_sequence
+from merge_text import remove_punctuation, convert_pinyin
+from pinyin_frontend import PinyinFrontend
+from _common import timed, write_report
+
+
+def legacy_ids(line):
+  phonemes = convert_pinyin(remove_punctuation(line))
+  if phonemes == "":
+    # cleaned_text_to_sequence would fail on the empty symbol
+    return [0]
+  return commons.intersperse(cleaned_text_to_sequence(phonemes), 0)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("text_file", help="one utterance per line, filelist lines use their text column")
+  parser.add_argument("--repeats", type=int, default=3)
+  parser.add_argument("--output", default=None, help="JSON file, defaults to stdout")
+  args = parser.parse_args()
+
+  with open(args.text_file, encoding="utf-8") as f:
+    lines = [line.strip().split("|")[-1] for line in f]
+  lines = [line for line in lines if line]
+  num_chars = sum(len(line) for line in lines)
+
+  frontend = PinyinFrontend(add_blank=True)
+  mismatches = sum(1 for line in lines if frontend(line) != legacy_ids(line))
+
+  legacy_s = timed(legacy_ids, lines, args.repeats) / 1000.
+  frontend_s = timed(frontend, lines, args.repeats) / 1000.
+
+  report = {
+    "text_file": args.text_file,
+    "lines": len(lines),
+    "chars": num_chars,
+    "mismatches": mismatches,
+    "legacy": {"seconds": legacy_s, "lines_per_s": len(lines) / legacy_s, "chars_per_s": num_chars / legacy_s},
+    "frontend": {"seconds": frontend_s, "lines_per_s": len(lines) / frontend_s, "chars_per_s": num_chars / frontend_s},
+    "speedup": legacy_s / frontend_s,
+  }
+  write_report(report, args.output)
@@ -0,0 +1,128 @@
+"""
+CPU inference benchmark for SynthesizerTrn.infer with randomly initialized weights.
+
+Reports the latency of every inference stage and the real-time factor
+(synthesis time / audio duration) for each combination of text length,
+batch size, thread count, noise_scale and length_scale, as JSON.
+
+  python benchmarks/bench_infer.py -c configs/tr_base.json --lengths 50 200 --threads 1 4
+"""
+import os
+import sys
+import time
+import argparse
+import itertools
+import collections
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils
+from models import SynthesizerTrn
+from text.pinyin_symbols import pinyin_symbols
+from _common import write_report
+
+
+STAGES = ["text_encoder", "duration_predictor", "flow", "generator"]
+
+
+class StageTimer():
+  """Accumulates the wall time spent in enc_p, dp, flow and dec via forward hooks."""
+  def __init__(self, net_g):
+    self.times = collections.defaultdict(float)
+    self._start = {}
+    modules = [net_g.enc_p, net_g.dp, net_g.flow, net_g.dec]
+    for name, module in zip(STAGES, modules):
+      module.register_forward_pre_hook(self._pre_hook(name))
+      module.register_forward_hook(self._hook(name))
+
+  def _pre_hook(self, name):
+    def hook(module, inputs):
+      self._start[name] = time.perf_counter()
+    return hook
+
+  def _hook(self, name):
+    def hook(module, inputs, outputs):
+      self.times[name] += time.perf_counter() - self._start[name]
+    return hook
+
+  def reset(self):
+    self.times.clear()
+
+
+def run(net_g, timer, hps, text_length, batch_size, noise_scale, length_scale, noise_scale_w, repeats):
+  x = torch.randint(1, net_g.n_vocab, (batch_size, text_length))
+  x_lengths = torch.LongTensor([text_length] * batch_size)
+  sid = torch.zeros(batch_size, dtype=torch.long) if net_g.n_speakers > 0 else None
+
+  with torch.no_grad():
+    # warm up
+    net_g.infer(x, x_lengths, sid=sid, noise_scale=noise_scale, length_scale=length_scale, noise_scale_w=noise_scale_w)
+    timer.reset()
+    total = 0.
+    audio_samples = 0
+    for _ in range(repeats):
+      start = time.perf_counter()
+      _, _, y_mask, _ = net_g.infer(x, x_lengths, sid=sid, noise_scale=noise_scale,
+          length_scale=length_scale, noise_scale_w=noise_scale_w)
+      total += time.perf_counter() - start
+      audio_samples += int(y_mask.sum()) * net_g.hop_length
+
+  stages = {k: 1000. * timer.times[k] / repeats for k in STAGES}
+  # everything between the duration predictor and the flow: generate_path,
+  # prior expansion and sampling of z_p
+  stages["generate_path"] = 1000. * total / repeats - sum(stages.values())
+  audio_seconds = audio_samples / repeats / hps.data.sampling_rate
+  return {
+    "text_length": text_length,
+    "batch_size": batch_size,
+    "noise_scale": noise_scale,
+    "length_scale": length_scale,
+    "noise_scale_w": noise_scale_w,
+    "audio_seconds": audio_seconds,
+    "total_ms": 1000. * total / repeats,
+    "rtf": total / repeats / audio_seconds,
+    "stages_ms": stages,
+  }
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", default="configs/tr_base.json")
+  parser.add_argument("--lengths", nargs="+", type=int, default=[32, 64, 128, 256])
+  parser.add_argument("--batch_sizes", nargs="+", type=int, default=[1, 4])
+  parser.add_argument("--threads", nargs="+", type=int, default=[1, 4])
+  parser.add_argument("--noise_scales", nargs="+", type=float, default=[0.667])
+  parser.add_argument("--length_scales", nargs="+", type=float, default=[1.0])
+  parser.add_argument("--noise_scale_w", type=float, default=0.8)
+  parser.add_argument("--repeats", type=int, default=3)
+  parser.add_argument("--output", default=None, help="JSON file, defaults to stdout")
+  args = parser.parse_args()
+
+  hps = utils.get_hparams_from_file(args.config)
+  torch.manual_seed(1234)
+  net_g = SynthesizerTrn(
+      len(pinyin_symbols),
+      hps.data.filter_length // 2 + 1,
+      hps.train.segment_size // hps.data.hop_length,
+      n_speakers=hps.data.n_speakers,
+      **hps.model)
+  net_g.eval()
+  timer = StageTimer(net_g)
+
+  results = []
+  for threads, text_length, batch_size, noise_scale, length_scale in itertools.product(
+      args.threads, args.lengths, args.batch_sizes, args.noise_scales, args.length_scales):
+    torch.set_num_threads(threads)
+    result = run(net_g, timer, hps, text_length, batch_size, noise_scale, length_scale,
+        args.noise_scale_w, args.repeats)
+    result["threads"] = threads
+    print("threads={} length={} batch={} rtf={:.3f}".format(
+      threads, text_length, batch_size, result["rtf"]), file=sys.stderr)
+    results.append(result)
+
+  report = {
+    "config": args.config,
+    "torch_version": torch.__version__,
+    "results": results,
+  }
+  write_report(report, args.output)
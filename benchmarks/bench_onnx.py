@@ -0,0 +1,85 @@
+"""
+CPU latency of SynthesizerTrn.infer in PyTorch against the ONNX Runtime backend
+(export_onnx.py + onnx_infer.py), after checking that both agree with noise disabled.
+
+  python benchmarks/bench_onnx.py -c configs/tr_base.json --lengths 50 200 --threads 1 4
+  python benchmarks/bench_onnx.py -c configs/tr_base.json -i logs/tr_base/G_100000.pth
+"""
+import os
+import sys
+import argparse
+import itertools
+import tempfile
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils
+from models import SynthesizerTrn
+from export_checkpoint import build_inference_model
+from export_onnx import export_onnx, check_parity
+from onnx_infer import OnnxSynthesizer
+from text.pinyin_symbols import pinyin_symbols
+from _common import timed, write_report
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", default="configs/tr_base.json")
+  parser.add_argument("-i", "--input", default=None, help="generator checkpoint, random weights if omitted")
+  parser.add_argument("--lengths", nargs="+", type=int, default=[32, 64, 128, 256])
+  parser.add_argument("--threads", nargs="+", type=int, default=[1, 4])
+  parser.add_argument("--repeats", type=int, default=5)
+  parser.add_argument("--output", default=None, help="JSON file, defaults to stdout")
+  args = parser.parse_args()
+
+  hps = utils.get_hparams_from_file(args.config)
+  torch.manual_seed(1234)
+  if args.input is not None:
+    net_g, _ = build_inference_model(hps, args.input)
+  else:
+    net_g = SynthesizerTrn(
+        len(pinyin_symbols),
+        hps.data.filter_length // 2 + 1,
+        hps.train.segment_size // hps.data.hop_length,
+        n_speakers=hps.data.n_speakers,
+        inference_only=True,
+        **hps.model)
+    net_g.remove_weight_norm()
+    net_g.eval()
+
+  with tempfile.TemporaryDirectory() as model_dir:
+    export_onnx(net_g, model_dir)
+    parity = check_parity(net_g, OnnxSynthesizer(model_dir, net_g.hop_length), args.lengths)
+    print("max abs diff per length:", parity, file=sys.stderr)
+
+    results = []
+    for threads, text_length in itertools.product(args.threads, args.lengths):
+      torch.set_num_threads(threads)
+      synth = OnnxSynthesizer(model_dir, net_g.hop_length, num_threads=threads)
+      x = torch.randint(1, net_g.n_vocab, (1, text_length))
+      x_lengths = torch.LongTensor([text_length])
+      sid = torch.LongTensor([0]) if net_g.n_speakers > 0 else None
+      sid_np = None if sid is None else sid.numpy()
+
+      with torch.no_grad():
+        torch_ms = timed(lambda: net_g.infer(x, x_lengths, sid=sid, noise_scale=0.667, noise_scale_w=0.8), repeats=args.repeats)
+      onnx_ms = timed(lambda: synth.infer(x.numpy(), x_lengths.numpy(), sid=sid_np,
+          noise_scale=0.667, noise_scale_w=0.8), repeats=args.repeats)
+      print("threads={} length={} torch={:.1f}ms onnx={:.1f}ms".format(
+        threads, text_length, torch_ms, onnx_ms), file=sys.stderr)
+      results.append({
+        "threads": threads,
+        "text_length": text_length,
+        "torch_ms": torch_ms,
+        "onnx_ms": onnx_ms,
+        "speedup": torch_ms / onnx_ms,
+      })
+
+  report = {
+    "config": args.config,
+    "checkpoint": args.input,
+    "torch_version": torch.__version__,
+    "max_abs_diff": parity,
+    "results": results,
+  }
+  write_report(report, args.output)
@@ -0,0 +1,50 @@
+"""
+Latency of commons.slice_segments (one gather) against the per-row loop it
+replaced, on the three slices of a training step: the latent z, the linear
+spectrogram and the waveform. Exact equality of the two is checked by
+benchmarks/check_slice_segments.py.
+
+  python benchmarks/bench_slice_segments.py -c configs/tr_base.json
+  python benchmarks/bench_slice_segments.py -c configs/tr_base.json --device cuda --batch_size 64
+"""
+import os
+import sys
+import argparse
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils
+import commons
+from _common import timed, write_report
+from check_slice_segments import loop_slice_segments, training_inputs, random_ids_slice
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", default="configs/tr_base.json")
+  parser.add_argument("--device", default="cpu")
+  parser.add_argument("--batch_size", type=int, default=None, help="defaults to train.batch_size")
+  parser.add_argument("--frames", type=int, default=800, help="padded spectrogram length")
+  parser.add_argument("--repeats", type=int, default=20)
+  parser.add_argument("--output", default=None, help="JSON file, defaults to stdout")
+  args = parser.parse_args()
+
+  hps = utils.get_hparams_from_file(args.config)
+  device = torch.device(args.device)
+  sync = torch.cuda.synchronize if device.type == "cuda" else None
+  b = args.batch_size or hps.train.batch_size
+  ids_slice = random_ids_slice(hps, b, args.frames, device)
+
+  report = {"device": args.device, "batch_size": b, "frames": args.frames, "results": {}}
+  for name, (x, scale, segment_size) in training_inputs(hps, b, args.frames, device).items():
+    ids_str = ids_slice * scale
+    loop_ms = timed(lambda: loop_slice_segments(x, ids_str, segment_size), repeats=args.repeats, sync=sync)
+    gather_ms = timed(lambda: commons.slice_segments(x, ids_str, segment_size), repeats=args.repeats, sync=sync)
+    report["results"][name] = {
+      "shape": list(x.shape),
+      "segment_size": segment_size,
+      "loop_ms": loop_ms,
+      "gather_ms": gather_ms,
+      "speedup": loop_ms / gather_ms,
+    }
+  write_report(report, args.output)
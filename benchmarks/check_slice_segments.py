@@ -0,0 +1,87 @@
+"""
+Exact-equality check of commons.slice_segments (one gather) against the
+per-row loop it replaced: forward outputs and input gradients, bit for bit, on
+the three tensors a training step slices (latent z, linear spectrogram and
+waveform), including segments at the first and last valid offset.
+Exits with status 1 on any mismatch.
+
+  python benchmarks/check_slice_segments.py -c configs/tr_base.json
+  python benchmarks/check_slice_segments.py -c configs/tr_base.json --device cuda
+"""
+import os
+import sys
+import argparse
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils
+import commons
+
+
+def loop_slice_segments(x, ids_str, segment_size=4):
+  ret = torch.zeros_like(x[:, :, :segment_size])
+  for i in range(x.size(0)):
+    idx_str = ids_str[i]
+    idx_end = idx_str + segment_size
+    ret[i] = x[i, :, idx_str:idx_end]
+  return ret
+
+
+def check_equal(x, ids_str, segment_size):
+  """Forward outputs and input gradients of both versions, compared bit for bit."""
+  grads = []
+  outs = []
+  for fn in (loop_slice_segments, commons.slice_segments):
+    x_ = x.detach().clone().requires_grad_(True)
+    out = fn(x_, ids_str, segment_size)
+    out.backward(torch.arange(out.numel(), dtype=out.dtype, device=out.device).view_as(out))
+    outs.append(out.detach())
+    grads.append(x_.grad)
+  return torch.equal(outs[0], outs[1]) and torch.equal(grads[0], grads[1])
+
+
+def training_inputs(hps, batch_size, frames, device):
+  """name -> (x, offset scale, segment_size) for the slices of a training step."""
+  hop = hps.data.hop_length
+  segment_frames = hps.train.segment_size // hop
+  return {
+    "z": (torch.randn(batch_size, hps.model.inter_channels, frames, device=device), 1, segment_frames),
+    "spec": (torch.randn(batch_size, hps.data.filter_length // 2 + 1, frames, device=device), 1, segment_frames),
+    "wav": (torch.randn(batch_size, 1, frames * hop, device=device), hop, hps.train.segment_size),
+  }
+
+
+def random_ids_slice(hps, batch_size, frames, device):
+  """Segment starts as rand_slice_segments draws them, the longest row padded to frames."""
+  segment_frames = hps.train.segment_size // hps.data.hop_length
+  x_lengths = torch.randint(segment_frames, frames + 1, (batch_size,), device=device)
+  x_lengths[0] = frames
+  z = torch.empty(batch_size, 1, frames, device=device)
+  return commons.rand_slice_segments(z, x_lengths, segment_frames)[1]
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", default="configs/tr_base.json")
+  parser.add_argument("--device", default="cpu")
+  parser.add_argument("--batch_size", type=int, default=4)
+  parser.add_argument("--frames", type=int, default=200, help="padded spectrogram length")
+  args = parser.parse_args()
+
+  hps = utils.get_hparams_from_file(args.config)
+  device = torch.device(args.device)
+  segment_frames = hps.train.segment_size // hps.data.hop_length
+  ids_cases = {
+    "random": random_ids_slice(hps, args.batch_size, args.frames, device),
+    "first": torch.zeros(args.batch_size, dtype=torch.long, device=device),
+    "last": torch.full((args.batch_size,), args.frames - segment_frames, dtype=torch.long, device=device),
+  }
+
+  failed = []
+  for name, (x, scale, segment_size) in training_inputs(hps, args.batch_size, args.frames, device).items():
+    for case, ids_slice in ids_cases.items():
+      equal = check_equal(x, ids_slice * scale, segment_size)
+      print("{} {}: {}".format(name, case, "equal" if equal else "MISMATCH"))
+      if not equal:
+        failed.append((name, case))
+  sys.exit(1 if failed else 0)
@@ -0,0 +1,51 @@
+import os
+import argparse
+import functools
+import multiprocessing
+import numpy as np
+from scipy.io.wavfile import read
+
+import utils
+from utils import load_filepaths_and_text
+
+
+def _num_samples(filename, sampling_rate):
+  # mmap only parses the header, the samples are never read
+  orig_sr, data = read(filename, mmap=True)
+  # what the loaders see once data.resample has converted the wav
+  return utils.resampled_length(len(data), orig_sr, sampling_rate)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", required=True, help="JSON file for configuration")
+  parser.add_argument("--filelists", nargs="+", default=None,
+                      help="defaults to the training and validation files of the config")
+  parser.add_argument("--num_workers", default=16, type=int)
+  parser.add_argument("--force", action="store_true", help="rebuild up-to-date indexes too")
+
+  args = parser.parse_args()
+  hps = utils.get_hparams_from_file(args.config)
+  filelists = args.filelists or [hps.data.training_files, hps.data.validation_files]
+  hop_length = hps.data.hop_length
+
+  for filelist in filelists:
+    if not args.force and utils.load_length_index(filelist, hop_length) is not None:
+      print("UP TO DATE:", filelist)
+      continue
+    print("START:", filelist)
+    filenames = [x[0] for x in load_filepaths_and_text(filelist)]
+    with multiprocessing.Pool(args.num_workers) as pool:
+      num_samples = pool.map(functools.partial(_num_samples, sampling_rate=hps.data.sampling_rate),
+                             filenames, chunksize=256)
+    # spectrogram_torch with center=False pads (n_fft - hop) samples in total,
+    # so the frame count is exactly num_samples // hop_length
+    lengths = np.array(num_samples, dtype=np.int64) // hop_length
+
+    index_path = utils.length_index_path(filelist)
+    # np.savez appends .npz to names without it, so the temp name keeps the suffix
+    tmp_path = index_path[:-len(".npz")] + ".tmp.npz"
+    np.savez(tmp_path, lengths=lengths.astype(np.int32),
+             filelist_hash=utils.filelist_hash(filelist), hop_length=hop_length)
+    os.replace(tmp_path, index_path)
+    print("DONE:", index_path, len(lengths), "items")
@@ -46,12 +46,12 @@ def rand_gumbel_like(x):
 
 
 def slice_segments(x, ids_str, segment_size=4):
-  ret = torch.zeros_like(x[:, :, :segment_size])
-  for i in range(x.size(0)):
-    idx_str = ids_str[i]
-    idx_end = idx_str + segment_size
-    ret[i] = x[i, :, idx_str:idx_end]
-  return ret
+  """x[i, :, ids_str[i]:ids_str[i]+segment_size] for every row, in one gather.
+  ids_str are frames for spectrograms and latents, samples for waveforms."""
+  b, d, t = x.size()
+  ids = ids_str.to(device=x.device, dtype=torch.long).view(b, 1, 1) \
+      + torch.arange(segment_size, device=x.device).view(1, 1, segment_size)
+  return torch.gather(x, 2, ids.expand(b, d, segment_size))
 
 
 def rand_slice_segments(x, x_lengths=None, segment_size=4):
@@ -144,18 +144,37 @@ def generate_path(duration, mask):
 
 
 def clip_grad_value_(parameters, clip_value, norm_type=2):
+  """Clamps gradients to [-clip_value, clip_value] in place and returns the
+  total norm of the unclamped gradients as a 0-dim tensor on their device,
+  so nothing waits on the device until the caller reads it.
+  Without clip_value (as in training) this is a single multi-tensor norm pass.
+  With it, the clamp adds two in-place multi-tensor passes, clamp_min_ and
+  clamp_max_, since torch has no fused two-sided foreach clamp and the norm
+  has to be taken before clamping."""
   if isinstance(parameters, torch.Tensor):
     parameters = [parameters]
-  parameters = list(filter(lambda p: p.grad is not None, parameters))
+  grads = [p.grad.detach() for p in parameters if p.grad is not None]
   norm_type = float(norm_type)
+  if len(grads) == 0:
+    return torch.tensor(0.)
+
+  if hasattr(torch, "_foreach_norm"):
+    norms = torch._foreach_norm(grads, norm_type)
+  else:
+    norms = [torch.norm(g, norm_type) for g in grads]
+  total_norm = torch.norm(torch.stack([n.float() for n in norms]), norm_type)
+
   if clip_value is not None:
     clip_value = float(clip_value)
-
-  total_norm = 0
-  for p in parameters:
-    param_norm = p.grad.data.norm(norm_type)
-    total_norm += param_norm.item() ** norm_type
-    if clip_value is not None:
-      p.grad.data.clamp_(min=-clip_value, max=clip_value)
-  total_norm = total_norm ** (1. / norm_type)
+    if hasattr(torch, "_foreach_clamp_min_"):
+      torch._foreach_clamp_min_(grads, -clip_value)
+      torch._foreach_clamp_max_(grads, clip_value)
+    else:
+      for g in grads:
+        g.clamp_(min=-clip_value, max=clip_value)
   return total_norm
+
+
+def set_requires_grad(module, requires_grad):
+  for p in module.parameters():
+    p.requires_grad_(requires_grad)
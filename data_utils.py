@@ -7,8 +7,9 @@ import torch.utils.data
 
 import commons 
 from mel_processing import spectrogram_torch
-from utils import load_wav_to_torch, load_filepaths_and_text
+from utils import load_wav_to_torch, load_wav_resampled, load_filepaths_and_text, spec_cache_valid, save_atomic, load_length_index
 from text import text_to_sequence, cleaned_text_to_sequence
+from shard_store import ShardReader, shard_dir_for
 
 
 class TextAudioLoader(torch.utils.data.Dataset):
@@ -17,8 +18,7 @@ class TextAudioLoader(torch.utils.data.Dataset):
         2) normalizes text and converts them to sequences of integers
         3) computes spectrograms from audio files.
     """
-    def __init__(self, audiopaths_and_text, hparams):
-        self.audiopaths_and_text = load_filepaths_and_text(audiopaths_and_text)
+    def __init__(self, audiopaths_and_text, hparams, metadata=None):
         self.text_cleaners  = hparams.text_cleaners
         self.max_wav_value  = hparams.max_wav_value
         self.sampling_rate  = hparams.sampling_rate
@@ -34,8 +34,33 @@ class TextAudioLoader(torch.utils.data.Dataset):
         #self.max_text_len = getattr(hparams, "max_text_len", 190)
         self.max_text_len = getattr(hparams, "max_text_len", 256)
 
+        # .spec.pt files are neither read nor written if preprocess_spec.py
+        # built them with different STFT parameters
+        self.spec_cache = spec_cache_valid(audiopaths_and_text, hparams)
+
+        # wavs at another rate are resampled once and cached as <name>.<rate>.wav
+        self.resample = getattr(hparams, "resample", False)
+
+        self.shards = None
+        if getattr(hparams, "use_shards", False):
+            self.shards = ShardReader(shard_dir_for(audiopaths_and_text), hparams)
+
+        # a TextAudioMetadata replaces reading, shuffling and filtering the filelist
+        self.metadata = metadata
+        if metadata is not None:
+            self.lengths = metadata.lengths
+            return
+
+        self.audiopaths_and_text = load_filepaths_and_text(audiopaths_and_text)
+        self.index_lengths = load_length_index(audiopaths_and_text, self.hop_length)
+
+        # shuffle an index permutation, so that paths and index lengths stay aligned
         random.seed(1234)
-        random.shuffle(self.audiopaths_and_text)
+        order = list(range(len(self.audiopaths_and_text)))
+        random.shuffle(order)
+        self.audiopaths_and_text = [self.audiopaths_and_text[i] for i in order]
+        if self.index_lengths is not None:
+            self.index_lengths = self.index_lengths[order]
         self._filter()
 
 
@@ -49,36 +74,47 @@ class TextAudioLoader(torch.utils.data.Dataset):
 
         audiopaths_and_text_new = []
         lengths = []
-        for audiopath, text in self.audiopaths_and_text:
+        for i, (audiopath, text) in enumerate(self.audiopaths_and_text):
             if self.min_text_len <= len(text) and len(text) <= self.max_text_len:
                 audiopaths_and_text_new.append([audiopath, text])
-                lengths.append(os.path.getsize(audiopath) // (2 * self.hop_length))
+                if self.shards is not None:
+                    lengths.append(self.shards.spec_length(audiopath))
+                elif self.index_lengths is not None:
+                    lengths.append(int(self.index_lengths[i]))
+                else:
+                    lengths.append(os.path.getsize(audiopath) // (2 * self.hop_length))
         self.audiopaths_and_text = audiopaths_and_text_new
         self.lengths = lengths
 
     def get_audio_text_pair(self, audiopath_and_text):
         # separate filename and text
         audiopath, text = audiopath_and_text[0], audiopath_and_text[1]
+        if self.shards is not None:
+            return self.shards.get(audiopath)
         text = self.get_text(text)
         spec, wav = self.get_audio(audiopath)
         return (text, spec, wav)
 
     def get_audio(self, filename):
-        audio, sampling_rate = load_wav_to_torch(filename)
+        if self.resample:
+            audio, sampling_rate = load_wav_resampled(filename, self.sampling_rate)
+        else:
+            audio, sampling_rate = load_wav_to_torch(filename)
         if sampling_rate != self.sampling_rate:
-            raise ValueError("{} {} SR doesn't match target {} SR".format(
-                sampling_rate, self.sampling_rate))
+            raise ValueError("{} {} SR doesn't match target {} SR, set data.resample to convert it".format(
+                filename, sampling_rate, self.sampling_rate))
         audio_norm = audio / self.max_wav_value
         audio_norm = audio_norm.unsqueeze(0)
         spec_filename = filename.replace(".wav", ".spec.pt")
-        if os.path.exists(spec_filename):
+        if self.spec_cache and os.path.exists(spec_filename):
             spec = torch.load(spec_filename)
         else:
             spec = spectrogram_torch(audio_norm, self.filter_length,
                 self.sampling_rate, self.hop_length, self.win_length,
                 center=False)
             spec = torch.squeeze(spec, 0)
-            torch.save(spec, spec_filename)
+            if self.spec_cache:
+                save_atomic(spec, spec_filename)
         return spec, audio_norm
 
     def get_text(self, text):
@@ -92,12 +128,34 @@ class TextAudioLoader(torch.utils.data.Dataset):
         return text_norm
 
     def __getitem__(self, index):
+        if self.metadata is not None:
+            audiopath = self.metadata.path(index)
+            if self.shards is not None:
+                return self.shards.get(audiopath)
+            spec, wav = self.get_audio(audiopath)
+            return (self.metadata.text(index), spec, wav)
         return self.get_audio_text_pair(self.audiopaths_and_text[index])
 
     def __len__(self):
+        if self.metadata is not None:
+            return len(self.metadata)
         return len(self.audiopaths_and_text)
 
 
+def _pad_rows(tensors):
+    """Right zero-pads tensors along their last dim into one preallocated batch tensor.
+    Only the padded tail of each row is zeroed, the rest is overwritten by the copy.
+    Returns the padded batch and the original lengths.
+    """
+    lengths = torch.LongTensor([x.size(-1) for x in tensors])
+    max_len = int(lengths.max())
+    padded = tensors[0].new_empty((len(tensors),) + tuple(tensors[0].shape[:-1]) + (max_len,))
+    for i, x in enumerate(tensors):
+        padded[i, ..., :x.size(-1)] = x
+        padded[i, ..., x.size(-1):] = 0
+    return padded, lengths
+
+
 class TextAudioCollate():
     """ Zero-pads model inputs and targets
     """
@@ -115,34 +173,10 @@ class TextAudioCollate():
             torch.LongTensor([x[1].size(1) for x in batch]),
             dim=0, descending=True)
 
-        max_text_len = max([len(x[0]) for x in batch])
-        max_spec_len = max([x[1].size(1) for x in batch])
-        max_wav_len = max([x[2].size(1) for x in batch])
-
-        text_lengths = torch.LongTensor(len(batch))
-        spec_lengths = torch.LongTensor(len(batch))
-        wav_lengths = torch.LongTensor(len(batch))
-
-        text_padded = torch.LongTensor(len(batch), max_text_len)
-        spec_padded = torch.FloatTensor(len(batch), batch[0][1].size(0), max_spec_len)
-        wav_padded = torch.FloatTensor(len(batch), 1, max_wav_len)
-        text_padded.zero_()
-        spec_padded.zero_()
-        wav_padded.zero_()
-        for i in range(len(ids_sorted_decreasing)):
-            row = batch[ids_sorted_decreasing[i]]
-
-            text = row[0]
-            text_padded[i, :text.size(0)] = text
-            text_lengths[i] = text.size(0)
-
-            spec = row[1]
-            spec_padded[i, :, :spec.size(1)] = spec
-            spec_lengths[i] = spec.size(1)
-
-            wav = row[2]
-            wav_padded[i, :, :wav.size(1)] = wav
-            wav_lengths[i] = wav.size(1)
+        rows = [batch[i] for i in ids_sorted_decreasing.tolist()]
+        text_padded, text_lengths = _pad_rows([x[0] for x in rows])
+        spec_padded, spec_lengths = _pad_rows([x[1] for x in rows])
+        wav_padded, wav_lengths = _pad_rows([x[2] for x in rows])
 
         if self.return_ids:
             return text_padded, text_lengths, spec_padded, spec_lengths, wav_padded, wav_lengths, ids_sorted_decreasing
@@ -156,8 +190,7 @@ class TextAudioSpeakerLoader(torch.utils.data.Dataset):
         2) normalizes text and converts them to sequences of integers
         3) computes spectrograms from audio files.
     """
-    def __init__(self, audiopaths_sid_text, hparams):
-        self.audiopaths_sid_text = load_filepaths_and_text(audiopaths_sid_text)
+    def __init__(self, audiopaths_sid_text, hparams, metadata=None):
         self.text_cleaners = hparams.text_cleaners
         self.max_wav_value = hparams.max_wav_value
         self.sampling_rate = hparams.sampling_rate
@@ -172,8 +205,33 @@ class TextAudioSpeakerLoader(torch.utils.data.Dataset):
         #self.max_text_len = getattr(hparams, "max_text_len", 190)
         self.max_text_len = getattr(hparams, "max_text_len", 256)
 
+        # .spec.pt files are neither read nor written if preprocess_spec.py
+        # built them with different STFT parameters
+        self.spec_cache = spec_cache_valid(audiopaths_sid_text, hparams)
+
+        # wavs at another rate are resampled once and cached as <name>.<rate>.wav
+        self.resample = getattr(hparams, "resample", False)
+
+        self.shards = None
+        if getattr(hparams, "use_shards", False):
+            self.shards = ShardReader(shard_dir_for(audiopaths_sid_text), hparams)
+
+        # a TextAudioMetadata replaces reading, shuffling and filtering the filelist
+        self.metadata = metadata
+        if metadata is not None:
+            self.lengths = metadata.lengths
+            return
+
+        self.audiopaths_sid_text = load_filepaths_and_text(audiopaths_sid_text)
+        self.index_lengths = load_length_index(audiopaths_sid_text, self.hop_length)
+
+        # shuffle an index permutation, so that paths and index lengths stay aligned
         random.seed(1234)
-        random.shuffle(self.audiopaths_sid_text)
+        order = list(range(len(self.audiopaths_sid_text)))
+        random.shuffle(order)
+        self.audiopaths_sid_text = [self.audiopaths_sid_text[i] for i in order]
+        if self.index_lengths is not None:
+            self.index_lengths = self.index_lengths[order]
         self._filter()
 
     def _filter(self):
@@ -186,37 +244,49 @@ class TextAudioSpeakerLoader(torch.utils.data.Dataset):
 
         audiopaths_sid_text_new = []
         lengths = []
-        for audiopath, sid, text in self.audiopaths_sid_text:
+        for i, (audiopath, sid, text) in enumerate(self.audiopaths_sid_text):
             if self.min_text_len <= len(text) and len(text) <= self.max_text_len:
                 audiopaths_sid_text_new.append([audiopath, sid, text])
-                lengths.append(os.path.getsize(audiopath) // (2 * self.hop_length))
+                if self.shards is not None:
+                    lengths.append(self.shards.spec_length(audiopath))
+                elif self.index_lengths is not None:
+                    lengths.append(int(self.index_lengths[i]))
+                else:
+                    lengths.append(os.path.getsize(audiopath) // (2 * self.hop_length))
         self.audiopaths_sid_text = audiopaths_sid_text_new
         self.lengths = lengths
 
     def get_audio_text_speaker_pair(self, audiopath_sid_text):
         # separate filename, speaker_id and text
         audiopath, sid, text = audiopath_sid_text[0], audiopath_sid_text[1], audiopath_sid_text[2]
+        sid = self.get_sid(sid)
+        if self.shards is not None:
+            text, spec, wav = self.shards.get(audiopath)
+            return (text, spec, wav, sid)
         text = self.get_text(text)
         spec, wav = self.get_audio(audiopath)
-        sid = self.get_sid(sid)
         return (text, spec, wav, sid)
 
     def get_audio(self, filename):
-        audio, sampling_rate = load_wav_to_torch(filename)
+        if self.resample:
+            audio, sampling_rate = load_wav_resampled(filename, self.sampling_rate)
+        else:
+            audio, sampling_rate = load_wav_to_torch(filename)
         if sampling_rate != self.sampling_rate:
-            raise ValueError("{} {} SR doesn't match target {} SR".format(
-                sampling_rate, self.sampling_rate))
+            raise ValueError("{} {} SR doesn't match target {} SR, set data.resample to convert it".format(
+                filename, sampling_rate, self.sampling_rate))
         audio_norm = audio / self.max_wav_value
         audio_norm = audio_norm.unsqueeze(0)
         spec_filename = filename.replace(".wav", ".spec.pt")
-        if os.path.exists(spec_filename):
+        if self.spec_cache and os.path.exists(spec_filename):
             spec = torch.load(spec_filename)
         else:
             spec = spectrogram_torch(audio_norm, self.filter_length,
                 self.sampling_rate, self.hop_length, self.win_length,
                 center=False)
             spec = torch.squeeze(spec, 0)
-            torch.save(spec, spec_filename)
+            if self.spec_cache:
+                save_atomic(spec, spec_filename)
         return spec, audio_norm
 
     def get_text(self, text):
@@ -234,9 +304,19 @@ class TextAudioSpeakerLoader(torch.utils.data.Dataset):
         return sid
 
     def __getitem__(self, index):
+        if self.metadata is not None:
+            audiopath = self.metadata.path(index)
+            sid = self.get_sid(self.metadata.sids[index])
+            if self.shards is not None:
+                text, spec, wav = self.shards.get(audiopath)
+                return (text, spec, wav, sid)
+            spec, wav = self.get_audio(audiopath)
+            return (self.metadata.text(index), spec, wav, sid)
         return self.get_audio_text_speaker_pair(self.audiopaths_sid_text[index])
 
     def __len__(self):
+        if self.metadata is not None:
+            return len(self.metadata)
         return len(self.audiopaths_sid_text)
 
 
@@ -257,41 +337,82 @@ class TextAudioSpeakerCollate():
             torch.LongTensor([x[1].size(1) for x in batch]),
             dim=0, descending=True)
 
-        max_text_len = max([len(x[0]) for x in batch])
-        max_spec_len = max([x[1].size(1) for x in batch])
-        max_wav_len = max([x[2].size(1) for x in batch])
+        rows = [batch[i] for i in ids_sorted_decreasing.tolist()]
+        text_padded, text_lengths = _pad_rows([x[0] for x in rows])
+        spec_padded, spec_lengths = _pad_rows([x[1] for x in rows])
+        wav_padded, wav_lengths = _pad_rows([x[2] for x in rows])
+        sid = torch.cat([x[3] for x in rows])
 
-        text_lengths = torch.LongTensor(len(batch))
-        spec_lengths = torch.LongTensor(len(batch))
-        wav_lengths = torch.LongTensor(len(batch))
-        sid = torch.LongTensor(len(batch))
+        if self.return_ids:
+            return text_padded, text_lengths, spec_padded, spec_lengths, wav_padded, wav_lengths, sid, ids_sorted_decreasing
+        return text_padded, text_lengths, spec_padded, spec_lengths, wav_padded, wav_lengths, sid
 
-        text_padded = torch.LongTensor(len(batch), max_text_len)
-        spec_padded = torch.FloatTensor(len(batch), batch[0][1].size(0), max_spec_len)
-        wav_padded = torch.FloatTensor(len(batch), 1, max_wav_len)
-        text_padded.zero_()
-        spec_padded.zero_()
-        wav_padded.zero_()
-        for i in range(len(ids_sorted_decreasing)):
-            row = batch[ids_sorted_decreasing[i]]
 
-            text = row[0]
-            text_padded[i, :text.size(0)] = text
-            text_lengths[i] = text.size(0)
+class TextAudioMetadata():
+    """
+        Filtered and shuffled entries of a TextAudioLoader / TextAudioSpeakerLoader
+        (paths, token ids, speaker ids) and their spectrogram lengths, as flat
+        numpy arrays. Built once before the training processes are spawned and
+        memory-mapped by every rank and DataLoader worker, so the pages are
+        shared instead of copied per process.
+    """
+    FILES = ["paths", "path_offsets", "text_ids", "text_offsets", "lengths", "sids"]
 
-            spec = row[1]
-            spec_padded[i, :, :spec.size(1)] = spec
-            spec_lengths[i] = spec.size(1)
+    def __init__(self, paths, path_offsets, text_ids, text_offsets, lengths, sids=None):
+        self.paths = paths                # utf-8 bytes of all paths, concatenated
+        self.path_offsets = path_offsets  # [n + 1]
+        self.text_ids = text_ids          # token ids of all texts, concatenated
+        self.text_offsets = text_offsets  # [n + 1]
+        self.lengths = lengths
+        self.sids = sids
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        speakers = isinstance(dataset, TextAudioSpeakerLoader)
+        items = dataset.audiopaths_sid_text if speakers else dataset.audiopaths_and_text
+        paths = [item[0].encode("utf-8") for item in items]
+        texts = [dataset.get_text(item[-1]).numpy() for item in items]
+        sids = np.array([int(item[1]) for item in items], dtype=np.int64) if speakers else None
+        return cls(
+            np.frombuffer(b"".join(paths), dtype=np.uint8),
+            np.cumsum([0] + [len(p) for p in paths], dtype=np.int64),
+            np.concatenate(texts + [np.zeros(0, dtype=np.int64)]).astype(np.int32),
+            np.cumsum([0] + [len(t) for t in texts], dtype=np.int64),
+            np.array(dataset.lengths, dtype=np.int64),
+            sids)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name in self.FILES:
+            array = getattr(self, name)
+            path = os.path.join(directory, name + ".npy")
+            if array is None:
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            # np.save appends .npy to names without it, so the temp name keeps the suffix
+            tmp_path = os.path.join(directory, name + ".tmp.npy")
+            np.save(tmp_path, array)
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, directory):
+        arrays = {}
+        for name in cls.FILES:
+            path = os.path.join(directory, name + ".npy")
+            arrays[name] = np.load(path, mmap_mode="r") if os.path.exists(path) else None
+        return cls(**arrays)
 
-            wav = row[2]
-            wav_padded[i, :, :wav.size(1)] = wav
-            wav_lengths[i] = wav.size(1)
+    def __len__(self):
+        return len(self.lengths)
 
-            sid[i] = row[3]
+    def path(self, index):
+        start, end = self.path_offsets[index], self.path_offsets[index + 1]
+        return self.paths[start:end].tobytes().decode("utf-8")
 
-        if self.return_ids:
-            return text_padded, text_lengths, spec_padded, spec_lengths, wav_padded, wav_lengths, sid, ids_sorted_decreasing
-        return text_padded, text_lengths, spec_padded, spec_lengths, wav_padded, wav_lengths, sid
+    def text(self, index):
+        start, end = self.text_offsets[index], self.text_offsets[index + 1]
+        return torch.from_numpy(self.text_ids[start:end].astype(np.int64))
 
 
 class DistributedBucketSampler(torch.utils.data.distributed.DistributedSampler):
@@ -302,24 +423,26 @@ class DistributedBucketSampler(torch.utils.data.distributed.DistributedSampler):
   
     It removes samples which are not included in the boundaries.
     Ex) boundaries = [b1, b2, b3] -> any x s.t. length(x) <= b1 or length(x) > b3 are discarded.
+
+    With max_frames, the batch_size samples of an optimizer step are yielded as
+    micro-batches of at most max_frames padded frames; micro_batch_info holds the
+    (weight, is_last) of every yielded batch, weight being its share of the step.
     """
-    def __init__(self, dataset, batch_size, boundaries, num_replicas=None, rank=None, shuffle=True):
+    def __init__(self, dataset, batch_size, boundaries, num_replicas=None, rank=None, shuffle=True, max_frames=None):
         super().__init__(dataset, num_replicas=num_replicas, rank=rank, shuffle=shuffle)
         self.lengths = dataset.lengths
         self.batch_size = batch_size
         self.boundaries = boundaries
+        self.max_frames = max_frames
   
         self.buckets, self.num_samples_per_bucket = self._create_buckets()
         self.total_size = sum(self.num_samples_per_bucket)
         self.num_samples = self.total_size // self.num_replicas
   
     def _create_buckets(self):
-        buckets = [[] for _ in range(len(self.boundaries) - 1)]
-        for i in range(len(self.lengths)):
-            length = self.lengths[i]
-            idx_bucket = self._bisect(length)
-            if idx_bucket != -1:
-                buckets[idx_bucket].append(i)
+        # same assignment as _bisect, for all lengths at once
+        idx_buckets = np.searchsorted(self.boundaries, np.asarray(self.lengths), side='left') - 1
+        buckets = [np.nonzero(idx_buckets == i)[0].tolist() for i in range(len(self.boundaries) - 1)]
   
         for i in range(len(buckets) - 1, 0, -1):
             if len(buckets[i]) == 0:
@@ -369,10 +492,30 @@ class DistributedBucketSampler(torch.utils.data.distributed.DistributedSampler):
       if self.shuffle:
           batch_ids = torch.randperm(len(batches), generator=g).tolist()
           batches = [batches[i] for i in batch_ids]
-      self.batches = batches
-  
-      assert len(self.batches) * self.batch_size == self.num_samples
+      assert len(batches) * self.batch_size == self.num_samples
+
+      self.batches = []
+      self.micro_batch_info = []
+      for batch in batches:
+          micro_batches = self._split(batch)
+          for j, micro_batch in enumerate(micro_batches):
+              self.batches.append(micro_batch)
+              self.micro_batch_info.append((len(micro_batch) / len(batch), j == len(micro_batches) - 1))
       return iter(self.batches)
+
+    def _split(self, batch):
+      if self.max_frames is None:
+          return [batch]
+      # longest first, the padded length of a micro-batch is that of its first sample
+      batch = sorted(batch, key=lambda idx: self.lengths[idx], reverse=True)
+      micro_batches = [[]]
+      for idx in batch:
+          current = micro_batches[-1]
+          if current and (len(current) + 1) * self.lengths[current[0]] > self.max_frames:
+              current = []
+              micro_batches.append(current)
+          current.append(idx)
+      return micro_batches
   
     def _bisect(self, x, lo=0, hi=None):
       if hi is None:
@@ -390,4 +533,5 @@ class DistributedBucketSampler(torch.utils.data.distributed.DistributedSampler):
           return -1
 
     def __len__(self):
+        # optimizer steps, there may be more micro-batches
         return self.num_samples // self.batch_size
@@ -0,0 +1,61 @@
+"""
+Exports a training checkpoint (G_*.pth) for serving: weight norm folded into
+the decoder and flow weights, posterior encoder and optimizer state dropped,
+optionally fp16/bf16 weights.
+
+  python export_checkpoint.py -c configs/tr_base.json -i logs/tr_base/G_100000.pth -o tr_base.infer.pth
+
+Load it with
+  net_g = SynthesizerTrn(..., inference_only=True, **hps.model)
+  net_g.remove_weight_norm()
+  utils.load_inference_checkpoint("tr_base.infer.pth", net_g)
+"""
+import argparse
+import torch
+
+import utils
+from models import SynthesizerTrn
+
+DTYPES = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+
+
+def build_inference_model(hps, checkpoint_path):
+  """Builds an fp32 SynthesizerTrn in eval mode, without enc_q and weight norm,
+  from either a training checkpoint or one written by this script.
+  """
+  checkpoint_dict = torch.load(checkpoint_path, map_location='cpu')
+  saved_state_dict = checkpoint_dict['model']
+  net_g = SynthesizerTrn(
+      saved_state_dict['enc_p.emb.weight'].size(0),
+      hps.data.filter_length // 2 + 1,
+      hps.train.segment_size // hps.data.hop_length,
+      n_speakers=hps.data.n_speakers,
+      inference_only=True,
+      **hps.model)
+  if 'dtype' in checkpoint_dict:
+    net_g.remove_weight_norm()
+    net_g.load_state_dict(saved_state_dict)
+  else:
+    net_g.load_state_dict({k: v for k, v in saved_state_dict.items() if not k.startswith("enc_q.")})
+    net_g.remove_weight_norm()
+  net_g.eval()
+  return net_g, checkpoint_dict['iteration']
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", required=True, help="JSON file for configuration")
+  parser.add_argument("-i", "--input", required=True, help="generator checkpoint saved by train.py")
+  parser.add_argument("-o", "--output", required=True)
+  parser.add_argument("--dtype", default="fp32", choices=list(DTYPES.keys()))
+
+  args = parser.parse_args()
+  hps = utils.get_hparams_from_file(args.config)
+  net_g, iteration = build_inference_model(hps, args.input)
+
+  dtype = DTYPES[args.dtype]
+  state_dict = {k: v.to(dtype) if v.is_floating_point() else v for k, v in net_g.state_dict().items()}
+  torch.save({'model': state_dict,
+              'iteration': iteration,
+              'dtype': args.dtype}, args.output)
+  print("Saved {} ({} tensors, {})".format(args.output, len(state_dict), args.dtype))
@@ -0,0 +1,146 @@
+"""
+Exports SynthesizerTrn.infer as two ONNX graphs with dynamic batch, text and
+frame axes, to be run by onnx_infer.OnnxSynthesizer:
+
+  text_encoder.onnx: text encoder + duration predictor (reverse mode)
+  decoder.onnx:      reverse flow + decoder
+
+  python export_onnx.py -c configs/tr_base.json -i logs/tr_base/G_100000.pth -o onnx/tr_base
+
+After exporting, the ONNX Runtime output is compared against the PyTorch model
+with noise disabled.
+
+Python-side branches on the text length (the relative attention padding in
+attentions.py) are frozen at trace time for texts of at least window_size + 1
+tokens. export_onnx records that length in onnx_config.json and
+OnnxSynthesizer right-pads shorter texts up to it.
+"""
+import os
+import json
+import argparse
+import numpy as np
+import torch
+from torch import nn
+
+import utils
+from export_checkpoint import build_inference_model
+
+
+class TextEncoderGraph(nn.Module):
+  def __init__(self, net_g):
+    super().__init__()
+    self.net_g = net_g
+
+  def forward(self, x, x_lengths, length_scale, noise_scale_w, sid=None):
+    m_p, logs_p, x_mask, w_ceil, _ = self.net_g._infer_durations(x, x_lengths, sid=sid,
+        length_scale=length_scale, noise_scale_w=noise_scale_w)
+    return m_p, logs_p, x_mask, w_ceil
+
+
+class DecoderGraph(nn.Module):
+  def __init__(self, net_g):
+    super().__init__()
+    self.net_g = net_g
+
+  def forward(self, z_p, y_mask, sid=None):
+    g = None
+    if sid is not None:
+      g = self.net_g.emb_g(sid).unsqueeze(-1) # [b, h, 1]
+    z = self.net_g.flow(z_p, y_mask, g=g, reverse=True)
+    return self.net_g.dec(z * y_mask, g=g)
+
+
+def min_text_length(net_g):
+  """Shortest text the exported graphs handle without padding."""
+  window_size = net_g.enc_p.encoder.window_size
+  return 1 if window_size is None else window_size + 1
+
+
+def export_onnx(net_g, out_dir, opset_version=13, text_length=64):
+  """Writes text_encoder.onnx, decoder.onnx and onnx_config.json to out_dir."""
+  assert text_length >= min_text_length(net_g), "trace with at least {} tokens".format(min_text_length(net_g))
+  os.makedirs(out_dir, exist_ok=True)
+  with open(os.path.join(out_dir, "onnx_config.json"), "w") as f:
+    json.dump({"min_text_length": min_text_length(net_g)}, f)
+  # sid is a trailing input that only multi speaker graphs declare
+  speaker = (torch.LongTensor([0]),) if net_g.n_speakers > 0 else ()
+  speaker_inputs = ["sid"] if net_g.n_speakers > 0 else []
+  x = torch.randint(1, net_g.n_vocab, (1, text_length))
+  x_lengths = torch.LongTensor([text_length])
+  scales = (torch.tensor(1.), torch.tensor(0.8))
+
+  with torch.no_grad():
+    m_p, logs_p, x_mask, w_ceil = TextEncoderGraph(net_g)(x, x_lengths, *scales, *speaker)
+    torch.onnx.export(
+      TextEncoderGraph(net_g),
+      (x, x_lengths) + scales + speaker,
+      os.path.join(out_dir, "text_encoder.onnx"),
+      input_names=["x", "x_lengths", "length_scale", "noise_scale_w"] + speaker_inputs,
+      output_names=["m_p", "logs_p", "x_mask", "w_ceil"],
+      dynamic_axes={
+        "x": {0: "batch", 1: "text"},
+        "x_lengths": {0: "batch"},
+        "sid": {0: "batch"},
+        "m_p": {0: "batch", 2: "text"},
+        "logs_p": {0: "batch", 2: "text"},
+        "x_mask": {0: "batch", 2: "text"},
+        "w_ceil": {0: "batch", 2: "text"},
+      },
+      opset_version=opset_version)
+
+    t_y = 4 * text_length
+    z_p = torch.randn(1, m_p.size(1), t_y)
+    y_mask = torch.ones(1, 1, t_y)
+    torch.onnx.export(
+      DecoderGraph(net_g),
+      (z_p, y_mask) + speaker,
+      os.path.join(out_dir, "decoder.onnx"),
+      input_names=["z_p", "y_mask"] + speaker_inputs,
+      output_names=["o"],
+      dynamic_axes={
+        "z_p": {0: "batch", 2: "frames"},
+        "y_mask": {0: "batch", 2: "frames"},
+        "sid": {0: "batch"},
+        "o": {0: "batch", 2: "samples"},
+      },
+      opset_version=opset_version)
+
+
+def check_parity(net_g, synth, text_lengths=(3, 17, 64, 150)):
+  """Max abs difference between PyTorch and ONNX Runtime waveforms per text length,
+  with noise disabled. Raises if the output lengths differ. The default lengths
+  include one below min_text_length, which OnnxSynthesizer pads.
+  """
+  diffs = {}
+  for text_length in text_lengths:
+    x = torch.randint(1, net_g.n_vocab, (1, text_length))
+    x_lengths = torch.LongTensor([text_length])
+    sid = torch.LongTensor([0]) if net_g.n_speakers > 0 else None
+    with torch.no_grad():
+      o_ref, _, y_mask, _ = net_g.infer(x, x_lengths, sid=sid, noise_scale=0, noise_scale_w=0)
+    o, lengths = synth.infer(x.numpy(), x_lengths.numpy(), sid=None if sid is None else sid.numpy(),
+        noise_scale=0, noise_scale_w=0)
+    length_ref = int(y_mask.sum()) * net_g.hop_length
+    if int(lengths[0]) != length_ref:
+      raise AssertionError("length mismatch at text length {}: {} != {}".format(
+        text_length, int(lengths[0]), length_ref))
+    diffs[text_length] = float(np.abs(o - o_ref.numpy()).max())
+  return diffs
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", required=True, help="JSON file for configuration")
+  parser.add_argument("-i", "--input", required=True, help="training or exported generator checkpoint")
+  parser.add_argument("-o", "--output", required=True, help="output directory")
+  parser.add_argument("--opset", default=13, type=int)
+
+  args = parser.parse_args()
+  hps = utils.get_hparams_from_file(args.config)
+  net_g, _ = build_inference_model(hps, args.input)
+  export_onnx(net_g, args.output, opset_version=args.opset)
+
+  from onnx_infer import OnnxSynthesizer
+  synth = OnnxSynthesizer(args.output, net_g.hop_length)
+  for text_length, diff in check_parity(net_g, synth).items():
+    print("text length {}: max abs diff {:.2e}".format(text_length, diff))
@@ -0,0 +1,79 @@
+"""
+Traces SynthesizerTrn.infer (text encoder, duration predictor in reverse mode,
+length regulation, reverse flow and decoder) into a TorchScript module that can
+be loaded with torch.jit.load and no model code.
+
+  python export_torchscript.py -c configs/tr_base.json -i logs/tr_base/G_100000.pth -o tr_base.jit.pt
+
+  synth = torch.jit.load("tr_base.jit.pt")
+  audio, audio_lengths = synth(x, x_lengths, sid, noise_scale, length_scale, noise_scale_w)
+
+All inputs are tensors: x [b, t_x] and x_lengths [b] (int64), sid [b] (ignored by
+single speaker models) and the three scales as 0-dim float tensors.
+"""
+import argparse
+import torch
+from torch import nn
+
+import utils
+from export_checkpoint import build_inference_model
+
+
+class InferenceWrapper(nn.Module):
+  def __init__(self, net_g):
+    super().__init__()
+    self.net_g = net_g
+
+  def forward(self, x, x_lengths, sid, noise_scale, length_scale, noise_scale_w):
+    if self.net_g.n_speakers == 0:
+      sid = None
+    o, _, y_mask, _ = self.net_g.infer(x, x_lengths, sid=sid, noise_scale=noise_scale,
+        length_scale=length_scale, noise_scale_w=noise_scale_w)
+    y_lengths = y_mask.sum([1, 2]).long() * self.net_g.hop_length
+    return o, y_lengths
+
+
+def example_inputs(net_g, text_length, noise_scale=0.667, length_scale=1., noise_scale_w=0.8):
+  x = torch.randint(1, net_g.n_vocab, (1, text_length))
+  x_lengths = torch.LongTensor([text_length])
+  sid = torch.LongTensor([0])
+  return (x, x_lengths, sid, torch.tensor(noise_scale), torch.tensor(length_scale), torch.tensor(noise_scale_w))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", required=True, help="JSON file for configuration")
+  parser.add_argument("-i", "--input", required=True, help="training or exported generator checkpoint")
+  parser.add_argument("-o", "--output", required=True)
+  # Python-side branches on the text length (relative attention window) are
+  # frozen at trace time, so trace with a text longer than the attention window.
+  parser.add_argument("--trace_length", default=64, type=int)
+  parser.add_argument("--check_lengths", nargs="+", default=[37, 150], type=int,
+    help="text lengths, other than the traced one, the trace must reproduce")
+  parser.add_argument("--atol", default=1e-4, type=float, help="largest waveform difference allowed")
+
+  args = parser.parse_args()
+  hps = utils.get_hparams_from_file(args.config)
+  net_g, _ = build_inference_model(hps, args.input)
+  wrapper = InferenceWrapper(net_g).eval()
+
+  with torch.no_grad():
+    traced = torch.jit.trace(wrapper, example_inputs(net_g, args.trace_length), check_trace=False)
+
+    # The noise scales are zero, so both runs are deterministic and must agree;
+    # shapes the trace froze for the example input show up at the other lengths.
+    for check_length in [args.trace_length] + args.check_lengths:
+      inputs = example_inputs(net_g, check_length, noise_scale=0., noise_scale_w=0.)
+      o_ref, lengths_ref = wrapper(*inputs)
+      o, lengths = traced(*inputs)
+      assert torch.equal(lengths, lengths_ref), "traced output length differs at text length {}: {} != {}".format(
+        check_length, lengths.tolist(), lengths_ref.tolist())
+      assert o.shape == o_ref.shape, "traced output shape differs at text length {}: {} != {}".format(
+        check_length, list(o.shape), list(o_ref.shape))
+      max_diff = (o - o_ref).abs().max().item()
+      assert max_diff <= args.atol, "traced waveform differs at text length {}: max abs diff {:.2e} > {:.2e}".format(
+        check_length, max_diff, args.atol)
+      print("text length {}: max abs diff vs eager {:.2e}".format(check_length, max_diff))
+
+  traced.save(args.output)
+  print("Saved {}".format(args.output))
@@ -1,7 +1,9 @@
 import torch 
+from torch import nn
 from torch.nn import functional as F
 
 import commons
+from mel_processing import spec_to_mel_torch, mel_spectrogram_torch
 
 
 def feature_loss(fmap_r, fmap_g):
@@ -59,3 +61,40 @@ def kl_loss(z_p, logs_q, m_p, logs_p, z_mask):
   kl = torch.sum(kl * z_mask)
   l = kl / torch.sum(z_mask)
   return l
+
+
+class MelLoss(nn.Module):
+  """
+  L1 between the mel spectrograms of the reference and generated segments.
+  Only the sliced spectrogram frames go through the mel basis. With
+  single_stft, the reference mel is computed from the sliced reference audio
+  instead, in the same STFT call as the generated audio (its edge frames then
+  see reflect padding rather than the neighbouring audio).
+  Returns (loss, y_mel, y_hat_mel).
+  """
+  def __init__(self, hps_data, segment_frames, single_stft=False):
+    super().__init__()
+    self.hps_data = hps_data
+    self.segment_frames = segment_frames
+    self.single_stft = single_stft
+
+  def _mel(self, y):
+    h = self.hps_data
+    return mel_spectrogram_torch(y.float(), h.filter_length, h.n_mel_channels, h.sampling_rate,
+        h.hop_length, h.win_length, h.mel_fmin, h.mel_fmax, check_range=False)
+
+  def forward(self, spec, ids_slice, y, y_hat):
+    """
+    spec: [b, n_fft // 2 + 1, t] full spectrograms
+    ids_slice: [b] first frame of each segment
+    y, y_hat: [b, 1, segment_frames * hop_length] reference and generated segments
+    """
+    h = self.hps_data
+    if self.single_stft:
+      y_mel, y_hat_mel = self._mel(torch.cat([y.float(), y_hat.float()], 0).squeeze(1)).chunk(2, 0)
+    else:
+      spec = commons.slice_segments(spec, ids_slice, self.segment_frames)
+      y_mel = spec_to_mel_torch(spec, h.filter_length, h.n_mel_channels, h.sampling_rate,
+          h.mel_fmin, h.mel_fmax)
+      y_hat_mel = self._mel(y_hat.squeeze(1))
+    return F.l1_loss(y_mel, y_hat_mel), y_mel, y_hat_mel
@@ -48,10 +48,11 @@ mel_basis = {}
 hann_window = {}
 
 
-def spectrogram_torch(y, n_fft, sampling_rate, hop_size, win_size, center=False):
-    if torch.min(y) < -1.:
+def spectrogram_torch(y, n_fft, sampling_rate, hop_size, win_size, center=False, check_range=True):
+    # the range check reads back to the host, training passes check_range=False
+    if check_range and torch.min(y) < -1.:
         print('min value is ', torch.min(y))
-    if torch.max(y) > 1.:
+    if check_range and torch.max(y) > 1.:
         print('max value is ', torch.max(y))
 
     global hann_window
@@ -70,6 +71,29 @@ def spectrogram_torch(y, n_fft, sampling_rate, hop_size, win_size, center=False)
     return spec
 
 
+def spectrogram_torch_batch(ys, n_fft, sampling_rate, hop_size, win_size):
+    """
+    Batched spectrogram_torch(y, ..., center=False) over 1-D signals of different lengths.
+    Each signal is reflect-padded on its own before zero-padding to a common length,
+    so the returned spectrograms match the per-utterance ones frame for frame.
+    """
+    global hann_window
+    dtype_device = str(ys[0].dtype) + '_' + str(ys[0].device)
+    wnsize_dtype_device = str(win_size) + '_' + dtype_device
+    if wnsize_dtype_device not in hann_window:
+        hann_window[wnsize_dtype_device] = torch.hann_window(win_size).to(dtype=ys[0].dtype, device=ys[0].device)
+
+    pad = int((n_fft-hop_size)/2)
+    ys = [torch.nn.functional.pad(y.view(1, 1, -1), (pad, pad), mode='reflect').view(-1) for y in ys]
+    y = torch.nn.utils.rnn.pad_sequence(ys, batch_first=True)
+
+    spec = torch.stft(y, n_fft, hop_length=hop_size, win_length=win_size, window=hann_window[wnsize_dtype_device],
+                      center=False, pad_mode='reflect', normalized=False, onesided=True)
+
+    spec = torch.sqrt(spec.pow(2).sum(-1) + 1e-6)
+    return [spec[i, :, :(ys[i].size(0) - n_fft) // hop_size + 1] for i in range(len(ys))]
+
+
 def spec_to_mel_torch(spec, n_fft, num_mels, sampling_rate, fmin, fmax):
     global mel_basis
     dtype_device = str(spec.dtype) + '_' + str(spec.device)
@@ -82,10 +106,11 @@ def spec_to_mel_torch(spec, n_fft, num_mels, sampling_rate, fmin, fmax):
     return spec
 
 
-def mel_spectrogram_torch(y, n_fft, num_mels, sampling_rate, hop_size, win_size, fmin, fmax, center=False):
-    if torch.min(y) < -1.:
+def mel_spectrogram_torch(y, n_fft, num_mels, sampling_rate, hop_size, win_size, fmin, fmax, center=False, check_range=True):
+    # the range check reads back to the host, training passes check_range=False
+    if check_range and torch.min(y) < -1.:
         print('min value is ', torch.min(y))
-    if torch.max(y) > 1.:
+    if check_range and torch.max(y) > 1.:
         print('max value is ', torch.max(y))
 
     global mel_basis, hann_window
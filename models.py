@@ -208,6 +208,10 @@ class ResidualCouplingBlock(nn.Module):
         x = flow(x, x_mask, g=g, reverse=reverse)
     return x
 
+  def remove_weight_norm(self):
+    for flow in self.flows[0::2]:
+      flow.enc.remove_weight_norm()
+
 
 class PosteriorEncoder(nn.Module):
   def __init__(self,
@@ -264,6 +268,23 @@ class Generator(torch.nn.Module):
         self.conv_post = Conv1d(ch, 1, 7, 1, padding=3, bias=False)
         self.ups.apply(init_weights)
 
+        # Number of input frames on each side that can influence an output sample,
+        # summed over conv_pre, every upsampling stage with its resblocks and conv_post.
+        receptive_field = 3.
+        scale = 1
+        for u, k in zip(upsample_rates, upsample_kernel_sizes):
+            receptive_field += (k // u + 1) / scale
+            scale *= u
+            resblock_radius = 0
+            for k_r, d_r in zip(resblock_kernel_sizes, resblock_dilation_sizes):
+                r = sum((k_r - 1) // 2 * d for d in d_r)
+                if resblock is modules.ResBlock1:
+                    r += (k_r - 1) // 2 * len(d_r)
+                resblock_radius = max(resblock_radius, r)
+            receptive_field += resblock_radius / scale
+        receptive_field += 3. / scale
+        self.receptive_field = int(math.ceil(receptive_field))
+
         if gin_channels != 0:
             self.cond = nn.Conv1d(gin_channels, upsample_initial_channel, 1)
 
@@ -412,6 +433,7 @@ class SynthesizerTrn(nn.Module):
     n_speakers=0,
     gin_channels=0,
     use_sdp=True,
+    inference_only=False,
     **kwargs):
 
     super().__init__()
@@ -432,9 +454,13 @@ class SynthesizerTrn(nn.Module):
     self.upsample_kernel_sizes = upsample_kernel_sizes
     self.segment_size = segment_size
     self.n_speakers = n_speakers
+    self.hop_length = 1
+    for u in upsample_rates:
+      self.hop_length *= u
     self.gin_channels = gin_channels
 
     self.use_sdp = use_sdp
+    self.inference_only = inference_only
 
     self.enc_p = TextEncoder(n_vocab,
         inter_channels,
@@ -445,7 +471,9 @@ class SynthesizerTrn(nn.Module):
         kernel_size,
         p_dropout)
     self.dec = Generator(inter_channels, resblock, resblock_kernel_sizes, resblock_dilation_sizes, upsample_rates, upsample_initial_channel, upsample_kernel_sizes, gin_channels=gin_channels)
-    self.enc_q = PosteriorEncoder(spec_channels, inter_channels, hidden_channels, 5, 1, 16, gin_channels=gin_channels)
+    if not inference_only:
+      # only used by forward and voice_conversion
+      self.enc_q = PosteriorEncoder(spec_channels, inter_channels, hidden_channels, 5, 1, 16, gin_channels=gin_channels)
     self.flow = ResidualCouplingBlock(inter_channels, hidden_channels, 5, 1, 4, gin_channels=gin_channels)
 
     if use_sdp:
@@ -496,7 +524,7 @@ class SynthesizerTrn(nn.Module):
     o = self.dec(z_slice, g=g)
     return o, l_length, attn, ids_slice, x_mask, y_mask, (z, z_p, m_p, logs_p, m_q, logs_q)
 
-  def infer(self, x, x_lengths, sid=None, noise_scale=1, length_scale=1, noise_scale_w=1., max_len=None):
+  def _infer_durations(self, x, x_lengths, sid=None, length_scale=1, noise_scale_w=1.):
     x, m_p, logs_p, x_mask = self.enc_p(x, x_lengths)
     if self.n_speakers > 0:
       g = self.emb_g(sid).unsqueeze(-1) # [b, h, 1]
@@ -509,6 +537,11 @@ class SynthesizerTrn(nn.Module):
       logw = self.dp(x, x_mask, g=g)
     w = torch.exp(logw) * x_mask * length_scale
     w_ceil = torch.ceil(w)
+    return m_p, logs_p, x_mask, w_ceil, g
+
+  def _infer_latent(self, x, x_lengths, sid=None, noise_scale=1, length_scale=1, noise_scale_w=1.):
+    m_p, logs_p, x_mask, w_ceil, g = self._infer_durations(x, x_lengths, sid=sid,
+        length_scale=length_scale, noise_scale_w=noise_scale_w)
     y_lengths = torch.clamp_min(torch.sum(w_ceil, [1, 2]), 1).long()
     y_mask = torch.unsqueeze(commons.sequence_mask(y_lengths, None), 1).to(x_mask.dtype)
     attn_mask = torch.unsqueeze(x_mask, 2) * torch.unsqueeze(y_mask, -1)
@@ -519,8 +552,67 @@ class SynthesizerTrn(nn.Module):
 
     z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
     z = self.flow(z_p, y_mask, g=g, reverse=True)
+    return z, attn, y_mask, g, (z, z_p, m_p, logs_p)
+
+  def infer(self, x, x_lengths, sid=None, noise_scale=1, length_scale=1, noise_scale_w=1., max_len=None):
+    z, attn, y_mask, g, latents = self._infer_latent(x, x_lengths, sid=sid, noise_scale=noise_scale,
+        length_scale=length_scale, noise_scale_w=noise_scale_w)
     o = self.dec((z * y_mask)[:,:,:max_len], g=g)
-    return o, attn, y_mask, (z, z_p, m_p, logs_p)
+    return o, attn, y_mask, latents
+
+  def infer_stream(self, x, x_lengths, sid=None, noise_scale=1, length_scale=1, noise_scale_w=1., chunk_size=32, overlap=None):
+    """
+    Streaming version of infer for a single utterance.
+    The flow output is decoded chunk_size frames at a time. Each window is extended by
+    `overlap` frames of context on both sides (default: the decoder receptive field),
+    whose samples are trimmed, so the concatenated chunks match the infer output.
+    Yields waveform chunks [1, 1, chunk_size * hop_length] (the last one may be shorter).
+    """
+    assert x.size(0) == 1, "infer_stream synthesizes one utterance at a time."
+    if overlap is None:
+      overlap = self.dec.receptive_field
+    z, _, y_mask, g, _ = self._infer_latent(x, x_lengths, sid=sid, noise_scale=noise_scale,
+        length_scale=length_scale, noise_scale_w=noise_scale_w)
+    z = z * y_mask
+    t_y = z.size(2)
+    for start in range(0, t_y, chunk_size):
+      end = min(start + chunk_size, t_y)
+      ctx_start = max(0, start - overlap)
+      ctx_end = min(t_y, end + overlap)
+      o = self.dec(z[:, :, ctx_start:ctx_end], g=g)
+      yield o[:, :, (start - ctx_start) * self.hop_length:(end - ctx_start) * self.hop_length]
+
+  def infer_batch(self, x_list, sids=None, batch_size=16, noise_scale=1, length_scale=1, noise_scale_w=1.):
+    """
+    x_list: list of LongTensor [t_x], token ids of each utterance
+    sids: list of speaker ids, one per utterance
+    Utterances are sorted by length and synthesized batch_size at a time.
+    Returns the waveforms [t_wav], trimmed to their own length, in input order.
+    """
+    device = self.enc_p.emb.weight.device
+
+    order = sorted(range(len(x_list)), key=lambda i: x_list[i].size(0), reverse=True)
+    outputs = [None] * len(x_list)
+    for start in range(0, len(order), batch_size):
+      ids = order[start:start+batch_size]
+      x = torch.nn.utils.rnn.pad_sequence([x_list[i] for i in ids], batch_first=True).to(device)
+      x_lengths = torch.LongTensor([x_list[i].size(0) for i in ids]).to(device)
+      sid = None
+      if sids is not None:
+        sid = torch.LongTensor([sids[i] for i in ids]).to(device)
+      o, _, y_mask, _ = self.infer(x, x_lengths, sid=sid, noise_scale=noise_scale,
+          length_scale=length_scale, noise_scale_w=noise_scale_w)
+      y_lengths = (y_mask.sum([1, 2]).long() * self.hop_length).tolist()
+      for j, i in enumerate(ids):
+        outputs[i] = o[j, 0, :y_lengths[j]]
+    return outputs
+
+  def remove_weight_norm(self):
+    """Folds the weight norm of the decoder, flow and posterior encoder into plain weights."""
+    self.dec.remove_weight_norm()
+    self.flow.remove_weight_norm()
+    if not self.inference_only:
+      self.enc_q.enc.remove_weight_norm()
 
   def voice_conversion(self, y, y_lengths, sid_src, sid_tgt):
     assert self.n_speakers > 0, "n_speakers have to be larger than 0."
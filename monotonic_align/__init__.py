@@ -1,6 +1,39 @@
+import os
 import numpy as np
 import torch
-from .monotonic_align.core import maximum_path_c
+from .core_torch import maximum_path_torch
+
+try:
+  from .monotonic_align.core import maximum_path_c
+except ImportError:
+  maximum_path_c = None
+
+try:
+  from .core_numba import maximum_path_nb
+except ImportError:
+  maximum_path_nb = None
+
+
+def _select_backend():
+  """ VITS_MAS_BACKEND=cython|numba|torch forces a backend, otherwise the
+  first available one of cython, numba and torch is used.
+  """
+  available = {
+    "cython": maximum_path_c is not None,
+    "numba": maximum_path_nb is not None,
+    "torch": True,
+  }
+  backend = os.environ.get("VITS_MAS_BACKEND")
+  if backend is not None:
+    if not available.get(backend, False):
+      raise ImportError("Monotonic alignment backend '{}' is not available.".format(backend))
+    return backend
+  for backend in ["cython", "numba", "torch"]:
+    if available[backend]:
+      return backend
+
+
+BACKEND = _select_backend()
 
 
 def maximum_path(neg_cent, mask):
@@ -8,6 +41,9 @@ def maximum_path(neg_cent, mask):
   neg_cent: [b, t_t, t_s]
   mask: [b, t_t, t_s]
   """
+  if BACKEND == "torch":
+    return maximum_path_torch(neg_cent, mask)
+
   device = neg_cent.device
   dtype = neg_cent.dtype
   neg_cent = neg_cent.data.cpu().numpy().astype(np.float32)
@@ -15,5 +51,8 @@ def maximum_path(neg_cent, mask):
 
   t_t_max = mask.sum(1)[:, 0].data.cpu().numpy().astype(np.int32)
   t_s_max = mask.sum(2)[:, 0].data.cpu().numpy().astype(np.int32)
-  maximum_path_c(path, neg_cent, t_t_max, t_s_max)
+  if BACKEND == "cython":
+    maximum_path_c(path, neg_cent, t_t_max, t_s_max)
+  else:
+    maximum_path_nb(path, neg_cent, t_t_max, t_s_max)
   return torch.from_numpy(path).to(device=device, dtype=dtype)
@@ -0,0 +1,48 @@
+import torch
+
+
+def maximum_path_torch(neg_cent, mask, max_neg_val=-1e9):
+  """ PyTorch version of maximum_path_c that stays on the device of neg_cent.
+  Rows of the dynamic programming table only depend on the previous row, so each
+  row is computed for all batch items and all text positions at once.
+  Accumulation is done in float32, as in the Cython version.
+  neg_cent: [b, t_t, t_s]
+  mask: [b, t_t, t_s]
+  """
+  device = neg_cent.device
+  dtype = neg_cent.dtype
+  value = neg_cent.detach().float().clone()
+  b, t_y, t_x = value.shape
+  t_ys = mask.sum(1)[:, 0].long()
+  t_xs = mask.sum(2)[:, 0].long()
+
+  x_range = torch.arange(t_x, device=device).unsqueeze(0)
+  max_neg = torch.tensor(max_neg_val, dtype=torch.float32, device=device)
+  zero = torch.zeros((), dtype=torch.float32, device=device)
+
+  for y in range(t_y):
+    if y == 0:
+      v_cur = max_neg.expand(b, t_x)
+      v_prev = torch.where(x_range == 0, zero, max_neg).expand(b, t_x)
+    else:
+      prev_row = value[:, y-1]
+      v_cur = torch.where(x_range == y, max_neg, prev_row)
+      v_prev = torch.cat([max_neg.expand(b, 1), prev_row[:, :-1]], 1)
+    x_start = (t_xs + y - t_ys).unsqueeze(1)
+    x_end = torch.clamp_max(t_xs, y + 1).unsqueeze(1)
+    in_range = (x_range >= x_start) & (x_range < x_end)
+    value[:, y] = torch.where(in_range, value[:, y] + torch.max(v_prev, v_cur), value[:, y])
+
+  path = torch.zeros(b, t_y, t_x, dtype=torch.int32, device=device)
+  index = t_xs - 1
+  for y in range(t_y - 1, -1, -1):
+    active = y < t_ys
+    idx = index.clamp_min(0).unsqueeze(1)
+    path[:, y].scatter_(1, idx, active.unsqueeze(1).to(path.dtype))
+    if y > 0:
+      prev_row = value[:, y-1]
+      v_idx = prev_row.gather(1, idx).squeeze(1)
+      v_idx_prev = prev_row.gather(1, (idx - 1).clamp_min(0)).squeeze(1)
+      move = active & (index != 0) & ((index == y) | (v_idx < v_idx_prev))
+      index = index - move.long()
+  return path.to(dtype=dtype)
@@ -0,0 +1,84 @@
+"""
+ONNX Runtime backend for synthesis with the two graphs written by export_onnx.py:
+
+  text_encoder.onnx: x, x_lengths, length_scale, noise_scale_w[, sid] -> m_p, logs_p, x_mask, w_ceil
+  decoder.onnx:      z_p, y_mask[, sid] -> o
+
+Length regulation (the commons.generate_path step) and prior sampling run in
+NumPy between the two graphs. Texts shorter than the min_text_length recorded in
+onnx_config.json are right-padded up to it; x_lengths masks the padding out.
+"""
+import os
+import json
+import numpy as np
+import onnxruntime
+
+
+def sequence_mask(length, max_length=None):
+  if max_length is None:
+    max_length = length.max()
+  return np.arange(max_length)[None, :] < length[:, None]
+
+
+def generate_path(duration, mask):
+  """
+  duration: [b, 1, t_x]
+  mask: [b, 1, t_y, t_x]
+  """
+  b, _, t_y, t_x = mask.shape
+  cum_duration = np.cumsum(duration, -1)
+
+  cum_duration_flat = cum_duration.reshape(b * t_x)
+  path = sequence_mask(cum_duration_flat, t_y).astype(mask.dtype)
+  path = path.reshape(b, t_x, t_y)
+  path = path - np.pad(path, [[0, 0], [1, 0], [0, 0]])[:, :-1]
+  path = np.expand_dims(path, 1).transpose(0, 1, 3, 2) * mask
+  return path
+
+
+class OnnxSynthesizer():
+  def __init__(self, model_dir, hop_length, num_threads=None):
+    options = onnxruntime.SessionOptions()
+    if num_threads is not None:
+      options.intra_op_num_threads = num_threads
+    providers = ["CPUExecutionProvider"]
+    self.enc = onnxruntime.InferenceSession(os.path.join(model_dir, "text_encoder.onnx"), options, providers=providers)
+    self.dec = onnxruntime.InferenceSession(os.path.join(model_dir, "decoder.onnx"), options, providers=providers)
+    self.enc_inputs = set(i.name for i in self.enc.get_inputs())
+    self.dec_inputs = set(i.name for i in self.dec.get_inputs())
+    self.hop_length = hop_length
+    self.min_text_length = 1
+    config_path = os.path.join(model_dir, "onnx_config.json")
+    if os.path.exists(config_path):
+      with open(config_path) as f:
+        self.min_text_length = json.load(f)["min_text_length"]
+
+  def infer(self, x, x_lengths, sid=None, noise_scale=1, length_scale=1, noise_scale_w=1., rng=np.random):
+    """
+    x: int64 [b, t_x], x_lengths: int64 [b], sid: int64 [b] for multi speaker models
+    Returns the waveforms [b, 1, t_wav] and their lengths in samples.
+    """
+    if x.shape[1] < self.min_text_length:
+      # the graphs were traced for texts of at least min_text_length tokens
+      x = np.pad(x, [[0, 0], [0, self.min_text_length - x.shape[1]]])
+    feed = {
+      "x": x,
+      "x_lengths": x_lengths,
+      "sid": sid,
+      "length_scale": np.array(length_scale, dtype=np.float32),
+      "noise_scale_w": np.array(noise_scale_w, dtype=np.float32),
+    }
+    m_p, logs_p, x_mask, w_ceil = self.enc.run(None, {k: v for k, v in feed.items() if k in self.enc_inputs})
+
+    y_lengths = np.maximum(w_ceil.sum((1, 2)), 1).astype(np.int64)
+    y_mask = np.expand_dims(sequence_mask(y_lengths), 1).astype(x_mask.dtype)
+    attn_mask = np.expand_dims(x_mask, 2) * np.expand_dims(y_mask, -1)
+    attn = generate_path(w_ceil, attn_mask)[:, 0]
+
+    m_p = np.matmul(attn, m_p.transpose(0, 2, 1)).transpose(0, 2, 1) # [b, t', t], [b, t, d] -> [b, d, t']
+    logs_p = np.matmul(attn, logs_p.transpose(0, 2, 1)).transpose(0, 2, 1) # [b, t', t], [b, t, d] -> [b, d, t']
+    z_p = m_p + rng.standard_normal(m_p.shape).astype(m_p.dtype) * np.exp(logs_p) * noise_scale
+
+    feed = {"z_p": z_p, "y_mask": y_mask, "sid": sid}
+    o, = self.dec.run(None, {k: v for k, v in feed.items() if k in self.dec_inputs})
+    return o, y_lengths * self.hop_length
@@ -0,0 +1,32 @@
+import argparse
+import utils
+from data_utils import TextAudioLoader, TextAudioSpeakerLoader
+from shard_store import ShardWriter, shard_dir_for
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", required=True, help="JSON file for configuration")
+  parser.add_argument("--filelists", nargs="+", default=None,
+                      help="defaults to the training and validation files of the config")
+  parser.add_argument("--shard_size", default=1024, type=int, help="shard size in MB")
+
+  args = parser.parse_args()
+  hps = utils.get_hparams_from_file(args.config)
+  # Pack from the wavs, never from existing shards
+  hps.data.use_shards = False
+  filelists = args.filelists or [hps.data.training_files, hps.data.validation_files]
+  loader_cls = TextAudioSpeakerLoader if hps.data.n_speakers > 0 else TextAudioLoader
+
+  for filelist in filelists:
+    print("START:", filelist)
+    dataset = loader_cls(filelist, hps.data)
+    items = dataset.audiopaths_sid_text if hps.data.n_speakers > 0 else dataset.audiopaths_and_text
+    writer = ShardWriter(shard_dir_for(filelist), hps.data, shard_size=args.shard_size << 20)
+    for i, item in enumerate(items):
+      audiopath, text = item[0], item[-1]
+      spec, wav = dataset.get_audio(audiopath)
+      writer.add(audiopath, dataset.get_text(text), spec, wav)
+      if i % 1000 == 0:
+        print("{}/{}".format(i, len(items)))
+    writer.close()
+    print("DONE:", shard_dir_for(filelist), len(writer.rows), "items")
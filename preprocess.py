@@ -1,25 +1,54 @@
+import os
 import argparse
 import text
 from utils import load_filepaths_and_text
 
+
+def _resume(partial_path):
+  """Number of complete lines already in partial_path, dropping a half written last line."""
+  if not os.path.exists(partial_path):
+    return 0
+  with open(partial_path, "rb+") as f:
+    data = f.read()
+    end = data.rfind(b"\n") + 1
+    f.truncate(end)
+  return data[:end].count(b"\n")
+
+
 if __name__ == '__main__':
   parser = argparse.ArgumentParser()
   parser.add_argument("--out_extension", default="cleaned")
   parser.add_argument("--text_index", default=1, type=int)
   parser.add_argument("--filelists", nargs="+", default=["filelists/ljs_audio_text_val_filelist.txt", "filelists/ljs_audio_text_test_filelist.txt"])
   parser.add_argument("--text_cleaners", nargs="+", default=["english_cleaners2"])
+  parser.add_argument("--batch_size", default=1000, type=int, help="lines per phonemizer call")
+  parser.add_argument("--njobs", default=1, type=int, help="phonemizer processes per batch")
 
   args = parser.parse_args()
-    
+
 
   for filelist in args.filelists:
     print("START:", filelist)
     filepaths_and_text = load_filepaths_and_text(filelist)
-    for i in range(len(filepaths_and_text)):
-      original_text = filepaths_and_text[i][args.text_index]
-      cleaned_text = text._clean_text(original_text, args.text_cleaners)
-      filepaths_and_text[i][args.text_index] = cleaned_text
-
     new_filelist = filelist + "." + args.out_extension
-    with open(new_filelist, "w", encoding="utf-8") as f:
-      f.writelines(["|".join(x) + "\n" for x in filepaths_and_text])
+    # lines are appended batch by batch, a rerun continues after the last complete one
+    partial_filelist = new_filelist + ".partial"
+    done = _resume(partial_filelist)
+    if done:
+      print("RESUME:", filelist, done, "lines already cleaned")
+
+    with open(partial_filelist, "a", encoding="utf-8") as f:
+      for start in range(done, len(filepaths_and_text), args.batch_size):
+        batch = filepaths_and_text[start:start+args.batch_size]
+        cleaned_texts = text._clean_texts([x[args.text_index] for x in batch], args.text_cleaners, njobs=args.njobs)
+        # a short result would shift every later row onto another row's text
+        assert len(cleaned_texts) == len(batch), "{} cleaned texts for {} lines at line {}".format(
+          len(cleaned_texts), len(batch), start)
+        for x, cleaned_text in zip(batch, cleaned_texts):
+          x[args.text_index] = cleaned_text
+        f.writelines(["|".join(x) + "\n" for x in batch])
+        f.flush()
+        print("{}/{}".format(start + len(batch), len(filepaths_and_text)))
+
+    os.replace(partial_filelist, new_filelist)
+    print("DONE:", new_filelist)
@@ -0,0 +1,83 @@
+import os
+import json
+import argparse
+import multiprocessing
+import torch
+
+import utils
+from mel_processing import spectrogram_torch_batch
+from utils import load_wav_to_torch, load_filepaths_and_text
+
+_hps = None
+
+
+def _init_worker(hps):
+  global _hps
+  _hps = hps
+  # one process per core already, keep each STFT single threaded
+  torch.set_num_threads(1)
+
+
+def _process_batch(filenames):
+  audios = []
+  for filename in filenames:
+    if getattr(_hps, "resample", False):
+      audio, sampling_rate = utils.load_wav_resampled(filename, _hps.sampling_rate)
+    else:
+      audio, sampling_rate = load_wav_to_torch(filename)
+    if sampling_rate != _hps.sampling_rate:
+      raise ValueError("{} {} SR doesn't match target {} SR".format(
+        filename, sampling_rate, _hps.sampling_rate))
+    audios.append(audio / _hps.max_wav_value)
+
+  specs = spectrogram_torch_batch(audios, _hps.filter_length,
+    _hps.sampling_rate, _hps.hop_length, _hps.win_length)
+  for filename, spec in zip(filenames, specs):
+    # clone, otherwise torch.save stores the storage of the whole batch
+    utils.save_atomic(spec.clone(), filename.replace(".wav", ".spec.pt"))
+  return len(filenames)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", required=True, help="JSON file for configuration")
+  parser.add_argument("--filelists", nargs="+", default=None,
+                      help="defaults to the training and validation files of the config")
+  parser.add_argument("--num_workers", default=os.cpu_count(), type=int)
+  parser.add_argument("--batch_size", default=16, type=int, help="wavs per STFT call")
+  parser.add_argument("--force", action="store_true", help="recompute existing .spec.pt files")
+
+  args = parser.parse_args()
+  hps = utils.get_hparams_from_file(args.config)
+  filelists = args.filelists or [hps.data.training_files, hps.data.validation_files]
+  config_hash = utils.spec_config_hash(hps.data)
+
+  for filelist in filelists:
+    print("START:", filelist)
+    # a manifest with another hash means every cached spectrogram is stale
+    force = args.force or not utils.spec_cache_valid(filelist, hps.data)
+    all_filenames = sorted(set(x[0] for x in load_filepaths_and_text(filelist)))
+    filenames = all_filenames
+    if not force:
+      filenames = [f for f in filenames if not os.path.exists(f.replace(".wav", ".spec.pt"))]
+    # group wavs of similar length so that batches carry little padding
+    filenames.sort(key=os.path.getsize)
+    batches = [filenames[i:i+args.batch_size] for i in range(0, len(filenames), args.batch_size)]
+
+    done = 0
+    with multiprocessing.Pool(args.num_workers, initializer=_init_worker, initargs=(hps.data,)) as pool:
+      for n in pool.imap_unordered(_process_batch, batches):
+        done += n
+        if done % 1000 < n:
+          print("{}/{}".format(done, len(filenames)))
+
+    manifest = {
+      "config_hash": config_hash,
+      "config": utils.spec_config(hps.data),
+      "num_files": len(all_filenames),
+    }
+    manifest_path = utils.spec_manifest_path(filelist)
+    with open(manifest_path + ".tmp", "w") as f:
+      json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    print("DONE:", filelist, len(filenames), "spectrograms written")
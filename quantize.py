@@ -0,0 +1,227 @@
+"""
+Static int8 quantization of the CPU inference path: the Generator convolutions
+(conv_pre, ResBlock convs, conv_post and, where the installed torch has a
+quantized ConvTranspose1d, the upsampling layers) and the 1x1 attention / FFN
+convolutions of the text encoder. Activation ranges are calibrated on the texts
+of a filelist; everything between the quantized convs (masks, activations,
+residual sums, flows) stays fp32.
+
+Static rather than dynamic quantization: torch.quantization.quantize_dynamic
+only handles nn.Linear and recurrent layers, and every matmul of this model is
+an nn.Conv1d (the attention / FFN projections are 1x1 convs), so a dynamic pass
+would leave the whole model in fp32.
+
+  python quantize.py -c configs/tr_base.json -i logs/tr_base/G_100000.pth \
+    --calibration_filelist filelists/tr_val.txt -o tr_base.int8.pth
+
+The script reports the mel L1 distance between fp32 and int8 output (noise
+disabled) and the latency of both. Load the result with
+  net_g, _ = quantize.load_int8_model(hps, "tr_base.int8.pth")
+which checks the reloaded model against an output recorded at save time.
+"""
+import time
+import argparse
+import torch
+from torch import nn
+import torch.quantization
+import torch.nn.quantized as nnq
+
+import commons
+import utils
+from models import SynthesizerTrn
+from export_checkpoint import build_inference_model
+from mel_processing import mel_spectrogram_torch
+from text import text_to_sequence, cleaned_text_to_sequence
+
+
+class QuantizedConv(nn.Module):
+  """Runs the wrapped conv in int8 and returns fp32, so that it is a drop-in
+  replacement whatever surrounds the conv."""
+  def __init__(self, conv):
+    super().__init__()
+    self.quant = torch.quantization.QuantStub()
+    self.conv = conv
+    self.dequant = torch.quantization.DeQuantStub()
+
+  def forward(self, x):
+    return self.dequant(self.conv(self.quant(x)))
+
+
+def _wrap(module, name, qconfig):
+  wrapped = QuantizedConv(getattr(module, name))
+  wrapped.qconfig = qconfig
+  setattr(module, name, wrapped)
+
+
+def _wrap_list(modules, qconfig):
+  for i in range(len(modules)):
+    _wrap(modules, str(i), qconfig)
+
+
+def _qconfigs(backend, calibrated=True):
+  """qconfigs of the regular and the transposed convs. Without calibration
+  (a model about to load saved qparams) min/max observers are used, they
+  convert to placeholder qparams when they have seen no data."""
+  if calibrated:
+    qconfig = torch.quantization.get_default_qconfig(backend)
+  else:
+    qconfig = torch.quantization.QConfig(
+      activation=torch.quantization.default_observer,
+      weight=torch.quantization.default_per_channel_weight_observer)
+  # per-channel weight observers do not apply to transposed convs
+  transposed_qconfig = torch.quantization.QConfig(
+    activation=qconfig.activation, weight=torch.quantization.default_weight_observer)
+  return qconfig, transposed_qconfig
+
+
+def quantize_targets(net_g, backend="fbgemm", calibrated=True):
+  """Wraps the quantizable convs of net_g in place and attaches their qconfigs."""
+  qconfig, transposed_qconfig = _qconfigs(backend, calibrated)
+
+  dec = net_g.dec
+  _wrap(dec, "conv_pre", qconfig)
+  _wrap(dec, "conv_post", qconfig)
+  for resblock in dec.resblocks:
+    _wrap_list(resblock.convs1, qconfig)
+    if hasattr(resblock, "convs2"):
+      _wrap_list(resblock.convs2, qconfig)
+  if hasattr(nnq, "ConvTranspose1d"):
+    _wrap_list(dec.ups, transposed_qconfig)
+
+  encoder = net_g.enc_p.encoder
+  for attn in encoder.attn_layers:
+    for name in ["conv_q", "conv_k", "conv_v", "conv_o"]:
+      _wrap(attn, name, qconfig)
+  for ffn in encoder.ffn_layers:
+    _wrap(ffn, "conv_1", qconfig)
+    _wrap(ffn, "conv_2", qconfig)
+
+
+def prepare_int8(net_g, backend="fbgemm", calibrated=True):
+  torch.backends.quantized.engine = backend
+  quantize_targets(net_g, backend, calibrated)
+  torch.quantization.prepare(net_g, inplace=True)
+  return net_g
+
+
+def convert_int8(net_g):
+  torch.quantization.convert(net_g, inplace=True)
+  return net_g
+
+
+def text_ids(text, hps_data):
+  if hps_data.cleaned_text:
+    text_norm = cleaned_text_to_sequence(text)
+  else:
+    text_norm = text_to_sequence(text, hps_data.text_cleaners)
+  if hps_data.add_blank:
+    text_norm = commons.intersperse(text_norm, 0)
+  return torch.LongTensor(text_norm)
+
+
+def load_calibration_inputs(filelist, hps, num_texts):
+  """(x, x_lengths, sid) for the first num_texts lines of filelist."""
+  inputs = []
+  for item in utils.load_filepaths_and_text(filelist)[:num_texts]:
+    x = text_ids(item[-1], hps.data).unsqueeze(0)
+    sid = torch.LongTensor([int(item[1])]) if hps.data.n_speakers > 0 else None
+    inputs.append((x, torch.LongTensor([x.size(1)]), sid))
+  return inputs
+
+
+def calibrate(net_g, inputs):
+  with torch.no_grad():
+    for x, x_lengths, sid in inputs:
+      net_g.infer(x, x_lengths, sid=sid, noise_scale=.667, noise_scale_w=0.8)
+
+
+def mel_l1(net_g_ref, net_g, inputs, hps):
+  """Mean mel L1 between the outputs of both models, noise disabled so that
+  they share durations and latents up to quantization error."""
+  total = 0.
+  for x, x_lengths, sid in inputs:
+    with torch.no_grad():
+      y_ref = net_g_ref.infer(x, x_lengths, sid=sid, noise_scale=0, noise_scale_w=0)[0]
+      y = net_g.infer(x, x_lengths, sid=sid, noise_scale=0, noise_scale_w=0)[0]
+    length = min(y.size(-1), y_ref.size(-1))
+    mels = [mel_spectrogram_torch(o[:, 0, :length], hps.data.filter_length, hps.data.n_mel_channels,
+        hps.data.sampling_rate, hps.data.hop_length, hps.data.win_length,
+        hps.data.mel_fmin, hps.data.mel_fmax, check_range=False) for o in (y_ref, y)]
+    total += torch.nn.functional.l1_loss(mels[1], mels[0]).item()
+  return total / len(inputs)
+
+
+def latency_ms(net_g, inputs):
+  with torch.no_grad():
+    start = time.perf_counter()
+    for x, x_lengths, sid in inputs:
+      net_g.infer(x, x_lengths, sid=sid, noise_scale=.667, noise_scale_w=0.8)
+  return 1000. * (time.perf_counter() - start) / len(inputs)
+
+
+def reference_output(net_g, inputs):
+  """Noise-free output of net_g on the first input, stored with the checkpoint."""
+  x, x_lengths, sid = inputs[0]
+  with torch.no_grad():
+    audio = net_g.infer(x, x_lengths, sid=sid, noise_scale=0, noise_scale_w=0)[0]
+  return {'x': x, 'x_lengths': x_lengths, 'sid': sid, 'audio': audio}
+
+
+def load_int8_model(hps, checkpoint_path, backend="fbgemm", atol=1e-3):
+  """Rebuilds the quantized module structure, loads the weights and qparams of a
+  checkpoint written by this script and checks that it reproduces the output
+  recorded when it was saved."""
+  checkpoint_dict = torch.load(checkpoint_path, map_location='cpu')
+  saved_state_dict = checkpoint_dict['model']
+  net_g = SynthesizerTrn(
+      saved_state_dict['enc_p.emb.weight'].size(0),
+      hps.data.filter_length // 2 + 1,
+      hps.train.segment_size // hps.data.hop_length,
+      n_speakers=hps.data.n_speakers,
+      inference_only=True,
+      **hps.model)
+  net_g.remove_weight_norm()
+  net_g.eval()
+  convert_int8(prepare_int8(net_g, backend, calibrated=False))
+  net_g.load_state_dict(saved_state_dict)
+
+  reference = checkpoint_dict['reference']
+  audio = reference_output(net_g, [(reference['x'], reference['x_lengths'], reference['sid'])])['audio']
+  if audio.shape != reference['audio'].shape or (audio - reference['audio']).abs().max().item() > atol:
+    raise ValueError("{} does not reproduce its saved output, was it quantized for another backend than {}?".format(
+      checkpoint_path, backend))
+  return net_g, checkpoint_dict['iteration']
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", required=True, help="JSON file for configuration")
+  parser.add_argument("-i", "--input", required=True, help="training or exported generator checkpoint")
+  parser.add_argument("-o", "--output", required=True)
+  parser.add_argument("--calibration_filelist", required=True)
+  parser.add_argument("--num_calibration", default=64, type=int, help="texts used to calibrate")
+  parser.add_argument("--num_eval", default=16, type=int, help="texts used for the quality check")
+  parser.add_argument("--backend", default="fbgemm", choices=["fbgemm", "qnnpack"])
+
+  args = parser.parse_args()
+  hps = utils.get_hparams_from_file(args.config)
+  inputs = load_calibration_inputs(args.calibration_filelist, hps, args.num_calibration + args.num_eval)
+  calibration_inputs, eval_inputs = inputs[:args.num_calibration], inputs[args.num_calibration:]
+  if not eval_inputs:
+    # filelist shorter than requested, check on the calibration texts
+    eval_inputs = calibration_inputs[:args.num_eval]
+
+  net_g_ref, iteration = build_inference_model(hps, args.input)
+  net_g, _ = build_inference_model(hps, args.input)
+  prepare_int8(net_g, args.backend)
+  calibrate(net_g, calibration_inputs)
+  convert_int8(net_g)
+
+  torch.save({'model': net_g.state_dict(),
+              'iteration': iteration,
+              'quantization': "int8-" + args.backend,
+              'reference': reference_output(net_g, eval_inputs)}, args.output)
+  print("Saved {}, calibrated on {} texts".format(args.output, len(calibration_inputs)))
+  print("mel L1 int8 vs fp32: {:.4f}".format(mel_l1(net_g_ref, net_g, eval_inputs, hps)))
+  print("latency fp32 {:.1f}ms, int8 {:.1f}ms per text".format(
+    latency_ms(net_g_ref, eval_inputs), latency_ms(net_g, eval_inputs)))
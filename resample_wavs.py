@@ -0,0 +1,35 @@
+import argparse
+import functools
+import multiprocessing
+from scipy.io.wavfile import read
+
+import utils
+from utils import load_filepaths_and_text
+
+
+def _resample(filename, sampling_rate):
+  orig_sr, _ = read(filename, mmap=True)
+  if orig_sr == sampling_rate:
+    return 0
+  utils.load_wav_resampled(filename, sampling_rate)
+  return 1
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-c", "--config", required=True, help="JSON file for configuration")
+  parser.add_argument("--filelists", nargs="+", default=None,
+                      help="defaults to the training and validation files of the config")
+  parser.add_argument("--num_workers", default=16, type=int)
+
+  args = parser.parse_args()
+  hps = utils.get_hparams_from_file(args.config)
+  filelists = args.filelists or [hps.data.training_files, hps.data.validation_files]
+  resample = functools.partial(_resample, sampling_rate=hps.data.sampling_rate)
+
+  for filelist in filelists:
+    print("START:", filelist)
+    filenames = sorted(set(x[0] for x in load_filepaths_and_text(filelist)))
+    with multiprocessing.Pool(args.num_workers) as pool:
+      converted = sum(pool.imap_unordered(resample, filenames, chunksize=16))
+    print("DONE:", filelist, converted, "of", len(filenames), "wavs resampled to", hps.data.sampling_rate)
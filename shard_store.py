@@ -0,0 +1,153 @@
+import os
+import json
+import numpy as np
+import torch
+
+
+INDEX_DTYPE = np.dtype([
+  ("shard", np.int32),
+  ("text_offset", np.int64),
+  ("text_len", np.int32),
+  ("spec_offset", np.int64),
+  ("spec_len", np.int32),
+  ("wav_offset", np.int64),
+  ("wav_len", np.int32),
+])
+
+# Fields that change the packed features. A shard directory is only usable
+# by a loader whose data config matches these values.
+CONFIG_KEYS = ["sampling_rate", "filter_length", "hop_length", "win_length",
+               "max_wav_value", "add_blank", "cleaned_text"]
+
+_ALIGN = 8
+
+
+def shard_dir_for(filelist):
+  return filelist + ".shards"
+
+
+class ShardWriter():
+  """
+  Packs (text ids, linear spectrogram, normalized wav) triples into a few
+  large binary shards plus an offset index.
+
+  Layout of <out_dir>:
+    shard_00000.bin, shard_00001.bin, ...  raw little-endian arrays
+    index.npy                              one INDEX_DTYPE row per item
+    meta.json                              data config, spec channels and item keys
+  """
+  def __init__(self, out_dir, hparams, shard_size=1 << 30):
+    self.out_dir = out_dir
+    self.shard_size = shard_size
+    self.config = {k: getattr(hparams, k, None) for k in CONFIG_KEYS}
+    self.spec_channels = None
+    self.keys = []
+    self.rows = []
+
+    self._shard = -1
+    self._f = None
+    self._pos = 0
+    os.makedirs(out_dir, exist_ok=True)
+    self._next_shard()
+
+  def _next_shard(self):
+    if self._f is not None:
+      self._f.close()
+    self._shard += 1
+    self._f = open(os.path.join(self.out_dir, "shard_%05d.bin" % self._shard), "wb")
+    self._pos = 0
+
+  def _write(self, array):
+    pad = -self._pos % _ALIGN
+    if pad:
+      self._f.write(b"\0" * pad)
+      self._pos += pad
+    offset = self._pos
+    data = np.ascontiguousarray(array).tobytes()
+    self._f.write(data)
+    self._pos += len(data)
+    return offset
+
+  def add(self, key, text, spec, wav):
+    """
+    text: LongTensor [t_x]
+    spec: FloatTensor [spec_channels, t_y]
+    wav: FloatTensor [1, t_wav], already divided by max_wav_value
+    """
+    if self.spec_channels is None:
+      self.spec_channels = spec.size(0)
+    assert spec.size(0) == self.spec_channels
+
+    if self._pos >= self.shard_size:
+      self._next_shard()
+    text_offset = self._write(text.numpy().astype(np.int64))
+    spec_offset = self._write(spec.numpy().astype(np.float32))
+    wav_offset = self._write(wav.numpy().astype(np.float32))
+    self.rows.append((self._shard, text_offset, text.size(0),
+                      spec_offset, spec.size(1), wav_offset, wav.size(1)))
+    self.keys.append(key)
+
+  def close(self):
+    self._f.close()
+    index = np.array(self.rows, dtype=INDEX_DTYPE)
+    np.save(os.path.join(self.out_dir, "index.npy"), index)
+    meta = {
+      "config": self.config,
+      "spec_channels": self.spec_channels,
+      "num_shards": self._shard + 1,
+      "keys": self.keys,
+    }
+    with open(os.path.join(self.out_dir, "meta.json"), "w", encoding="utf-8") as f:
+      json.dump(meta, f)
+
+
+class ShardReader():
+  """
+  Memory-maps shards written by ShardWriter and returns tensors that view the
+  mapped pages directly. Shards are mapped lazily so that every DataLoader
+  worker opens its own mappings after fork.
+  """
+  def __init__(self, shard_dir, hparams=None):
+    self.shard_dir = shard_dir
+    with open(os.path.join(shard_dir, "meta.json"), encoding="utf-8") as f:
+      meta = json.load(f)
+    if hparams is not None:
+      for k in CONFIG_KEYS:
+        if meta["config"].get(k) != getattr(hparams, k, None):
+          raise ValueError("{} was packed with {}={}, but the config has {}".format(
+            shard_dir, k, meta["config"].get(k), getattr(hparams, k, None)))
+    self.spec_channels = meta["spec_channels"]
+    self.num_shards = meta["num_shards"]
+    self.index = np.load(os.path.join(shard_dir, "index.npy"))
+    self.key_to_row = {k: i for i, k in enumerate(meta["keys"])}
+    self._maps = None
+
+  def _open(self):
+    # mode="c" (copy-on-write) gives writable arrays, so torch.from_numpy
+    # does not warn, while never touching the files on disk.
+    self._maps = [
+      np.memmap(os.path.join(self.shard_dir, "shard_%05d.bin" % i), dtype=np.uint8, mode="c")
+      for i in range(self.num_shards)]
+
+  def __contains__(self, key):
+    return key in self.key_to_row
+
+  def __len__(self):
+    return len(self.index)
+
+  def spec_length(self, key):
+    return int(self.index[self.key_to_row[key]]["spec_len"])
+
+  def get(self, key):
+    if self._maps is None:
+      self._open()
+    row = self.index[self.key_to_row[key]]
+    buf = self._maps[row["shard"]]
+    text = np.frombuffer(buf, dtype=np.int64, count=row["text_len"], offset=row["text_offset"])
+    spec = np.frombuffer(buf, dtype=np.float32, count=self.spec_channels * row["spec_len"],
+                         offset=row["spec_offset"])
+    wav = np.frombuffer(buf, dtype=np.float32, count=row["wav_len"], offset=row["wav_offset"])
+    text = torch.from_numpy(text)
+    spec = torch.from_numpy(spec).view(self.spec_channels, -1)
+    wav = torch.from_numpy(wav).view(1, -1)
+    return text, spec, wav
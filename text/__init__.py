@@ -61,3 +61,18 @@ def _clean_text(text, cleaner_names):
       raise Exception('Unknown cleaner: %s' % name)
     text = cleaner(text)
   return text
+
+
+def _clean_texts(texts, cleaner_names, njobs=1):
+  '''_clean_text over a list of texts. Cleaners with a <name>_batch variant
+    (the phonemizing ones) run once over the whole list, in njobs processes.'''
+  for name in cleaner_names:
+    batch_cleaner = getattr(cleaners, name + '_batch', None)
+    if batch_cleaner:
+      texts = batch_cleaner(texts, njobs=njobs)
+      continue
+    cleaner = getattr(cleaners, name)
+    if not cleaner:
+      raise Exception('Unknown cleaner: %s' % name)
+    texts = [cleaner(text) for text in texts]
+  return texts
@@ -98,3 +98,26 @@ def english_cleaners2(text):
   phonemes = phonemize(text, language='en-us', backend='espeak', strip=True, preserve_punctuation=True, with_stress=True)
   phonemes = collapse_whitespace(phonemes)
   return phonemes
+
+
+def _english_phonemize_batch(texts, njobs, **kwargs):
+  texts = [expand_abbreviations(lowercase(convert_to_ascii(text))) for text in texts]
+  # phonemize drops empty lines from a list, they are kept out of the call and put back in place
+  nonempty = [i for i, text in enumerate(texts) if text.strip()]
+  phonemes = phonemize([texts[i] for i in nonempty], language='en-us', backend='espeak', strip=True, njobs=njobs, **kwargs)
+  if len(phonemes) != len(nonempty):
+    raise Exception('phonemize returned %d lines for %d texts' % (len(phonemes), len(nonempty)))
+  results = [''] * len(texts)
+  for i, p in zip(nonempty, phonemes):
+    results[i] = collapse_whitespace(p)
+  return results
+
+
+def english_cleaners_batch(texts, njobs=1):
+  '''english_cleaners over a list of texts with a single phonemizer call.'''
+  return _english_phonemize_batch(texts, njobs)
+
+
+def english_cleaners2_batch(texts, njobs=1):
+  '''english_cleaners2 over a list of texts with a single phonemizer call.'''
+  return _english_phonemize_batch(texts, njobs, preserve_punctuation=True, with_stress=True)
@@ -1,23 +1,25 @@
 import os
 import json
 import argparse
+import contextlib
 import datetime
 import itertools
 import math
+import time
 import torch
 from torch import nn, optim
-from torch.nn import functional as F
 from torch.utils.data import DataLoader
 from torch.utils.tensorboard import SummaryWriter
 import torch.multiprocessing as mp
 import torch.distributed as dist
 from torch.nn.parallel import DistributedDataParallel as DDP
-from torch.cuda.amp import autocast, GradScaler
+from torch.cuda.amp import GradScaler
 
 import commons
 import utils
 from data_utils import (
   TextAudioLoader,
+  TextAudioMetadata,
   TextAudioCollate,
   DistributedBucketSampler
 )
@@ -29,7 +31,8 @@ from losses import (
   generator_loss,
   discriminator_loss,
   feature_loss,
-  kl_loss
+  kl_loss,
+  MelLoss
 )
 from mel_processing import mel_spectrogram_torch, spec_to_mel_torch
 #from text.symbols import symbols
@@ -41,14 +44,21 @@ global_step = 0
 
 
 def main():
-  """Assume Single Node Multi GPUs Training Only"""
-  assert torch.cuda.is_available(), "CPU training is not allowed."
-
-  n_gpus = torch.cuda.device_count()
+  """Single node training, one process per GPU or, with "device": "cpu" in the
+  train config, num_processes CPU processes synchronized over gloo."""
+  hps = utils.get_hparams()
+  if getattr(hps.train, "device", "cuda") == "cpu":
+    n_gpus = getattr(hps.train, "num_processes", 1)
+  else:
+    assert torch.cuda.is_available(), "CUDA is not available, set \"device\": \"cpu\" in the train config for CPU training."
+    n_gpus = torch.cuda.device_count()
   os.environ['MASTER_ADDR'] = 'localhost'
   os.environ['MASTER_PORT'] = '8000'
 
-  hps = utils.get_hparams()
+  # read, filter and tokenize the filelists once, every rank memory-maps the result
+  for name, filelist in [("train", hps.data.training_files), ("eval", hps.data.validation_files)]:
+    dataset = TextAudioLoader(filelist, hps.data)
+    TextAudioMetadata.from_dataset(dataset).save(os.path.join(hps.model_dir, "metadata", name))
   mp.spawn(run, nprocs=n_gpus, args=(n_gpus, hps,))
 
 
@@ -61,25 +71,39 @@ def run(rank, n_gpus, hps):
     writer = SummaryWriter(log_dir=hps.model_dir)
     writer_eval = SummaryWriter(log_dir=os.path.join(hps.model_dir, "eval"))
 
-  dist.init_process_group(backend='nccl', init_method='env://', world_size=n_gpus, rank=rank)
+  cpu = getattr(hps.train, "device", "cuda") == "cpu"
+  dist.init_process_group(backend='gloo' if cpu else 'nccl', init_method='env://', world_size=n_gpus, rank=rank)
   torch.manual_seed(hps.train.seed)
-  torch.cuda.set_device(rank)
-
-  train_dataset = TextAudioLoader(hps.data.training_files, hps.data)
+  if cpu:
+    device = torch.device("cpu")
+    # every rank gets its own block of cores, DataLoader workers inherit it
+    num_threads = getattr(hps.train, "num_threads", None) or max(1, os.cpu_count() // n_gpus)
+    torch.set_num_threads(num_threads)
+    if hasattr(os, "sched_setaffinity"):
+      cores = sorted(os.sched_getaffinity(0))
+      os.sched_setaffinity(0, cores[rank * num_threads:(rank + 1) * num_threads] or cores)
+  else:
+    device = torch.device("cuda", rank)
+    torch.cuda.set_device(rank)
+
+  train_dataset = TextAudioLoader(hps.data.training_files, hps.data,
+      metadata=TextAudioMetadata.load(os.path.join(hps.model_dir, "metadata", "train")))
   train_sampler = DistributedBucketSampler(
       train_dataset,
       hps.train.batch_size,
       [32,300,400,500,600,700,800,900,1000],
       num_replicas=n_gpus,
       rank=rank,
-      shuffle=True)
+      shuffle=True,
+      max_frames=getattr(hps.train, "max_frames", None))
   collate_fn = TextAudioCollate()
-  train_loader = DataLoader(train_dataset, num_workers=6, shuffle=False, pin_memory=True,
+  train_loader = DataLoader(train_dataset, num_workers=6, shuffle=False, pin_memory=not cpu,
       collate_fn=collate_fn, batch_sampler=train_sampler)
   if rank == 0:
-    eval_dataset = TextAudioLoader(hps.data.validation_files, hps.data)
+    eval_dataset = TextAudioLoader(hps.data.validation_files, hps.data,
+        metadata=TextAudioMetadata.load(os.path.join(hps.model_dir, "metadata", "eval")))
     eval_loader = DataLoader(eval_dataset, num_workers=6, shuffle=False,
-        batch_size=hps.train.batch_size, pin_memory=True,
+        batch_size=hps.train.batch_size, pin_memory=not cpu,
         drop_last=False, collate_fn=collate_fn)
 
   net_g = SynthesizerTrn(
@@ -87,8 +111,8 @@ def run(rank, n_gpus, hps):
       len(pinyin_symbols),
       hps.data.filter_length // 2 + 1,
       hps.train.segment_size // hps.data.hop_length,
-      **hps.model).cuda(rank)
-  net_d = MultiPeriodDiscriminator(hps.model.use_spectral_norm).cuda(rank)
+      **hps.model).to(device)
+  net_d = MultiPeriodDiscriminator(hps.model.use_spectral_norm).to(device)
   optim_g = torch.optim.AdamW(
       net_g.parameters(), 
       hps.train.learning_rate, 
@@ -99,8 +123,8 @@ def run(rank, n_gpus, hps):
       hps.train.learning_rate, 
       betas=hps.train.betas, 
       eps=hps.train.eps)
-  net_g = DDP(net_g, device_ids=[rank])
-  net_d = DDP(net_d, device_ids=[rank])
+  net_g = DDP(net_g, device_ids=None if cpu else [rank])
+  net_d = DDP(net_d, device_ids=None if cpu else [rank])
 
   try:
     _, _, _, epoch_str = utils.load_checkpoint(utils.latest_checkpoint_path(hps.model_dir, "G_*.pth"), net_g, optim_g)
@@ -113,8 +137,11 @@ def run(rank, n_gpus, hps):
   scheduler_g = torch.optim.lr_scheduler.ExponentialLR(optim_g, gamma=hps.train.lr_decay, last_epoch=epoch_str-2)
   scheduler_d = torch.optim.lr_scheduler.ExponentialLR(optim_d, gamma=hps.train.lr_decay, last_epoch=epoch_str-2)
 
-  scaler = GradScaler(enabled=hps.train.fp16_run)
+  # bf16 needs no loss scaling
+  scaler = GradScaler(enabled=hps.train.fp16_run and not cpu)
 
+  max_steps = getattr(hps.train, "max_steps", None)
+  start_step, start_time = global_step, time.time()
   for epoch in range(epoch_str, hps.train.epochs + 1):
     if rank==0:
       train_and_evaluate(rank, epoch, hps, [net_g, net_d], [optim_g, optim_d], [scheduler_g, scheduler_d], scaler, [train_loader, eval_loader], logger, [writer, writer_eval])
@@ -122,6 +149,13 @@ def run(rank, n_gpus, hps):
       train_and_evaluate(rank, epoch, hps, [net_g, net_d], [optim_g, optim_d], [scheduler_g, scheduler_d], scaler, [train_loader, None], None, None)
     scheduler_g.step()
     scheduler_d.step()
+    if max_steps is not None and global_step >= max_steps:
+      break
+
+  if rank == 0 and max_steps is not None:
+    steps, elapsed = global_step - start_step, time.time() - start_time
+    logger.info("{} steps in {:.1f}s: {:.3f} steps/s, {:.2f} utterances/s".format(
+      steps, elapsed, steps / elapsed, steps * hps.train.batch_size * n_gpus / elapsed))
 
 
 def train_and_evaluate(rank, epoch, hps, nets, optims, schedulers, scaler, loaders, logger, writers):
@@ -135,85 +169,109 @@ def train_and_evaluate(rank, epoch, hps, nets, optims, schedulers, scaler, loade
   train_loader.batch_sampler.set_epoch(epoch)
   global global_step
 
+  device = next(net_g.parameters()).device
+  amp = getattr(hps.train, "bf16_run", False) if device.type == "cpu" else hps.train.fp16_run
+  max_steps = getattr(hps.train, "max_steps", None)
+  mel_loss = MelLoss(hps.data, hps.train.segment_size // hps.data.hop_length,
+      single_stft=getattr(hps.train, "single_stft_mel", False))
+
   net_g.train()
   net_d.train()
+  optim_g.zero_grad()
+  optim_d.zero_grad()
+  step_idx = 0
+  step_losses = {}
   for batch_idx, (x, x_lengths, spec, spec_lengths, y, y_lengths) in enumerate(train_loader):
-    x, x_lengths = x.cuda(rank, non_blocking=True), x_lengths.cuda(rank, non_blocking=True)
-    spec, spec_lengths = spec.cuda(rank, non_blocking=True), spec_lengths.cuda(rank, non_blocking=True)
-    y, y_lengths = y.cuda(rank, non_blocking=True), y_lengths.cuda(rank, non_blocking=True)
-
-    with autocast(enabled=hps.train.fp16_run):
-      y_hat, l_length, attn, ids_slice, x_mask, z_mask,\
-      (z, z_p, m_p, logs_p, m_q, logs_q) = net_g(x, x_lengths, spec, spec_lengths)
+    # micro-batches of one optimizer step accumulate their gradients locally,
+    # the last one all-reduces them and steps
+    weight, is_last = train_loader.batch_sampler.micro_batch_info[batch_idx]
+    x, x_lengths = x.to(device, non_blocking=True), x_lengths.to(device, non_blocking=True)
+    spec, spec_lengths = spec.to(device, non_blocking=True), spec_lengths.to(device, non_blocking=True)
+    y, y_lengths = y.to(device, non_blocking=True), y_lengths.to(device, non_blocking=True)
+
+    with contextlib.nullcontext() if is_last else net_g.no_sync():
+      with utils.autocast(device, enabled=amp):
+        y_hat, l_length, attn, ids_slice, x_mask, z_mask,\
+        (z, z_p, m_p, logs_p, m_q, logs_q) = net_g(x, x_lengths, spec, spec_lengths)
+
+        y = commons.slice_segments(y, ids_slice * hps.data.hop_length, hps.train.segment_size) # slice 
+        loss_mel, y_mel, y_hat_mel = mel_loss(spec, ids_slice, y, y_hat)
+
+      with contextlib.nullcontext() if is_last else net_d.no_sync():
+        with utils.autocast(device, enabled=amp):
+          # Discriminator
+          y_d_hat_r, y_d_hat_g, _, _ = net_d(y, y_hat.detach())
+          with utils.autocast(device, enabled=False):
+            loss_disc, losses_disc_r, losses_disc_g = discriminator_loss(y_d_hat_r, y_d_hat_g)
+            loss_disc_all = loss_disc
+        scaler.scale(loss_disc_all * weight).backward()
+      if is_last:
+        scaler.unscale_(optim_d)
+        grad_norm_d = commons.clip_grad_value_(net_d.parameters(), None)
+        scaler.step(optim_d)
+        optim_d.zero_grad()
+
+      # the generator loss must not add to the discriminator gradients. D is
+      # stepped above only on the last micro-batch, so earlier micro-batches
+      # score G against the D of the previous step and the last one against
+      # the updated D (without accumulation this is the usual D-then-G order)
+      commons.set_requires_grad(net_d, False)
+      with contextlib.nullcontext() if is_last else net_d.no_sync():
+        with utils.autocast(device, enabled=amp):
+          # Generator
+          y_d_hat_r, y_d_hat_g, fmap_r, fmap_g = net_d(y, y_hat)
+          with utils.autocast(device, enabled=False):
+            loss_dur = torch.sum(l_length.float())
+            loss_mel = loss_mel * hps.train.c_mel
+            loss_kl = kl_loss(z_p, logs_q, m_p, logs_p, z_mask) * hps.train.c_kl
+
+            loss_fm = feature_loss(fmap_r, fmap_g)
+            loss_gen, losses_gen = generator_loss(y_d_hat_g)
+            loss_gen_all = loss_gen + loss_fm + loss_mel + loss_dur + loss_kl
+        scaler.scale(loss_gen_all * weight).backward()
+      commons.set_requires_grad(net_d, True)
+
+    if rank == 0 and global_step % hps.train.log_interval == 0:
+      # the logged losses are weighted sums over the micro-batches of the step
+      micro_losses = {"loss/g/total": loss_gen_all, "loss/d/total": loss_disc_all, "loss/g/gen": loss_gen,
+          "loss/g/fm": loss_fm, "loss/g/mel": loss_mel, "loss/g/dur": loss_dur, "loss/g/kl": loss_kl}
+      micro_losses.update({"loss/g/{}".format(i): v for i, v in enumerate(losses_gen)})
+      micro_losses.update({"loss/d_r/{}".format(i): v for i, v in enumerate(losses_disc_r)})
+      micro_losses.update({"loss/d_g/{}".format(i): v for i, v in enumerate(losses_disc_g)})
+      for k, v in micro_losses.items():
+        v = (v.detach() if torch.is_tensor(v) else v) * weight
+        step_losses[k] = step_losses[k] + v if k in step_losses else v
+    if not is_last:
+      continue
 
-      mel = spec_to_mel_torch(
-          spec, 
-          hps.data.filter_length, 
-          hps.data.n_mel_channels, 
-          hps.data.sampling_rate,
-          hps.data.mel_fmin, 
-          hps.data.mel_fmax)
-      y_mel = commons.slice_segments(mel, ids_slice, hps.train.segment_size // hps.data.hop_length)
-      y_hat_mel = mel_spectrogram_torch(
-          y_hat.squeeze(1), 
-          hps.data.filter_length, 
-          hps.data.n_mel_channels, 
-          hps.data.sampling_rate, 
-          hps.data.hop_length, 
-          hps.data.win_length, 
-          hps.data.mel_fmin, 
-          hps.data.mel_fmax
-      )
-
-      y = commons.slice_segments(y, ids_slice * hps.data.hop_length, hps.train.segment_size) # slice 
-
-      # Discriminator
-      y_d_hat_r, y_d_hat_g, _, _ = net_d(y, y_hat.detach())
-      with autocast(enabled=False):
-        loss_disc, losses_disc_r, losses_disc_g = discriminator_loss(y_d_hat_r, y_d_hat_g)
-        loss_disc_all = loss_disc
-    optim_d.zero_grad()
-    scaler.scale(loss_disc_all).backward()
-    scaler.unscale_(optim_d)
-    grad_norm_d = commons.clip_grad_value_(net_d.parameters(), None)
-    scaler.step(optim_d)
-
-    with autocast(enabled=hps.train.fp16_run):
-      # Generator
-      y_d_hat_r, y_d_hat_g, fmap_r, fmap_g = net_d(y, y_hat)
-      with autocast(enabled=False):
-        loss_dur = torch.sum(l_length.float())
-        loss_mel = F.l1_loss(y_mel, y_hat_mel) * hps.train.c_mel
-        loss_kl = kl_loss(z_p, logs_q, m_p, logs_p, z_mask) * hps.train.c_kl
-
-        loss_fm = feature_loss(fmap_r, fmap_g)
-        loss_gen, losses_gen = generator_loss(y_d_hat_g)
-        loss_gen_all = loss_gen + loss_fm + loss_mel + loss_dur + loss_kl
-    optim_g.zero_grad()
-    scaler.scale(loss_gen_all).backward()
     scaler.unscale_(optim_g)
     grad_norm_g = commons.clip_grad_value_(net_g.parameters(), None)
     scaler.step(optim_g)
     scaler.update()
+    optim_g.zero_grad()
 
     if rank==0:
       if global_step % hps.train.log_interval == 0:
         lr = optim_g.param_groups[0]['lr']
-        losses = [loss_disc, loss_gen, loss_fm, loss_mel, loss_dur, loss_kl]
+        losses = [step_losses[k] for k in ["loss/d/total", "loss/g/gen", "loss/g/fm", "loss/g/mel", "loss/g/dur", "loss/g/kl"]]
         logger.info('Train Epoch: {} [{:.0f}%]'.format(
           epoch,
-          100. * batch_idx / len(train_loader)))
-        logger.info([x.item() for x in losses] + [global_step, lr])
+          100. * step_idx / len(train_loader)))
+        logger.info([float(x) for x in losses] + [global_step, lr])
         
-        scalar_dict = {"loss/g/total": loss_gen_all, "loss/d/total": loss_disc_all, "learning_rate": lr, "grad_norm_d": grad_norm_d, "grad_norm_g": grad_norm_g}
-        scalar_dict.update({"loss/g/fm": loss_fm, "loss/g/mel": loss_mel, "loss/g/dur": loss_dur, "loss/g/kl": loss_kl})
-
-        scalar_dict.update({"loss/g/{}".format(i): v for i, v in enumerate(losses_gen)})
-        scalar_dict.update({"loss/d_r/{}".format(i): v for i, v in enumerate(losses_disc_r)})
-        scalar_dict.update({"loss/d_g/{}".format(i): v for i, v in enumerate(losses_disc_g)})
+        scalar_dict = {k: v for k, v in step_losses.items() if k != "loss/g/gen"}
+        scalar_dict.update({"learning_rate": lr, "grad_norm_d": grad_norm_d.item(), "grad_norm_g": grad_norm_g.item()})
+        # the full mel is only needed for this image
+        mel = spec_to_mel_torch(
+            spec[:1].float(),
+            hps.data.filter_length,
+            hps.data.n_mel_channels,
+            hps.data.sampling_rate,
+            hps.data.mel_fmin,
+            hps.data.mel_fmax)
         image_dict = { 
-            "slice/mel_org": utils.plot_spectrogram_to_numpy(y_mel[0].data.cpu().numpy()),
-            "slice/mel_gen": utils.plot_spectrogram_to_numpy(y_hat_mel[0].data.cpu().numpy()), 
+            "slice/mel_org": utils.plot_spectrogram_to_numpy(y_mel[0].data.float().cpu().numpy()),
+            "slice/mel_gen": utils.plot_spectrogram_to_numpy(y_hat_mel[0].data.float().cpu().numpy()), 
             "all/mel": utils.plot_spectrogram_to_numpy(mel[0].data.cpu().numpy()),
             "all/attn": utils.plot_alignment_to_numpy(attn[0,0].data.cpu().numpy())
         }
@@ -228,6 +286,10 @@ def train_and_evaluate(rank, epoch, hps, nets, optims, schedulers, scaler, loade
         utils.save_checkpoint(net_g, optim_g, hps.train.learning_rate, epoch, os.path.join(hps.model_dir, "G_{}.pth".format(global_step)))
         utils.save_checkpoint(net_d, optim_d, hps.train.learning_rate, epoch, os.path.join(hps.model_dir, "D_{}.pth".format(global_step)))
     global_step += 1
+    step_idx += 1
+    step_losses = {}
+    if max_steps is not None and global_step >= max_steps:
+      break
   
   if rank == 0:
     logger.info('{} ====> Epoch: {}'.format(datetime.datetime.now(), epoch))
@@ -235,11 +297,12 @@ def train_and_evaluate(rank, epoch, hps, nets, optims, schedulers, scaler, loade
  
 def evaluate(hps, generator, eval_loader, writer_eval):
     generator.eval()
+    device = next(generator.parameters()).device
     with torch.no_grad():
       for batch_idx, (x, x_lengths, spec, spec_lengths, y, y_lengths) in enumerate(eval_loader):
-        x, x_lengths = x.cuda(0), x_lengths.cuda(0)
-        spec, spec_lengths = spec.cuda(0), spec_lengths.cuda(0)
-        y, y_lengths = y.cuda(0), y_lengths.cuda(0)
+        x, x_lengths = x.to(device), x_lengths.to(device)
+        spec, spec_lengths = spec.to(device), spec_lengths.to(device)
+        y, y_lengths = y.to(device), y_lengths.to(device)
 
         # remove else
         x = x[:1]
@@ -0,0 +1,197 @@
+import re
+import sys
+import wave
+import argparse
+import functools
+import multiprocessing
+import numpy as np
+
+import torch
+
+from vits_strings import chinese_to_phonemes
+from vits_strings import get_text_ids
+from vits_strings import load_model
+
+# vits_strings puts the repository root on sys.path
+import utils
+
+# Chunks end at these; sentences get a longer pause than clauses
+SENTENCE_PUNCTUATION = "。！？!?；;.…\n"
+CLAUSE_PUNCTUATION = "，、,：:"
+
+_SENTENCE_RE = re.compile("[^%s]+[%s]*" % (re.escape(SENTENCE_PUNCTUATION), re.escape(SENTENCE_PUNCTUATION)))
+_CLAUSE_RE = re.compile("[^%s]+[%s]*" % (re.escape(CLAUSE_PUNCTUATION), re.escape(CLAUSE_PUNCTUATION)))
+
+
+def split_text(text, max_chars=50):
+    """Splits text into chunks of at most max_chars characters, at sentence
+    punctuation first and at clause punctuation inside longer sentences.
+    Returns (chunk, pause) pairs, pause being "sentence" or "clause"."""
+    chunks = []
+    for sentence in _SENTENCE_RE.findall(text):
+        if len(sentence) <= max_chars:
+            chunks.append((sentence, "sentence"))
+            continue
+        pieces = []
+        for clause in _CLAUSE_RE.findall(sentence):
+            # a clause without punctuation is cut hard at max_chars
+            pieces += [clause[i:i+max_chars] for i in range(0, len(clause), max_chars)]
+        current = ""
+        for piece in pieces:
+            if current and len(current) + len(piece) > max_chars:
+                chunks.append((current, "clause"))
+                current = ""
+            current += piece
+        chunks.append((current, "sentence"))
+    return chunks
+
+
+def text_to_chunks(text, hps, max_chars=50, cache=None):
+    """Token ids of each chunk, chunks without any pinyin are dropped.
+    cache is an optional text_cache.TextIdCache."""
+    chunks = []
+    for chunk, pause in split_text(text, max_chars):
+        if cache is not None:
+            ids = cache.get(chunk)
+            if ids.numel() == 0:
+                continue
+            chunks.append((ids, pause))
+            continue
+        phonemes = chinese_to_phonemes(chunk)
+        if phonemes == "":
+            continue
+        chunks.append((get_text_ids(phonemes, hps), pause))
+    return chunks
+
+
+_hps = None
+_net_g = None
+
+def _init_worker(config_path, checkpoint_path, num_threads):
+    global _hps, _net_g
+    _hps, _net_g = load_model(config_path, checkpoint_path)
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+
+def _render_group(group, noise_scale, length_scale, noise_scale_w):
+    with torch.no_grad():
+        audios = _net_g.infer_batch([ids for ids, _ in group], batch_size=len(group),
+            noise_scale=noise_scale, length_scale=length_scale, noise_scale_w=noise_scale_w)
+    return [(audio.numpy(), pause) for audio, (_, pause) in zip(audios, group)]
+
+
+def render_chunks(chunks, config_path, checkpoint_path, batch_size=8, num_workers=0, num_threads=None,
+                  noise_scale=.667, length_scale=1, noise_scale_w=0.8):
+    """Yields (audio, pause) for every chunk, in text order. Consecutive chunks
+    are synthesized batch_size at a time, in this process or, with num_workers,
+    one batch per worker process."""
+    groups = [chunks[i:i+batch_size] for i in range(0, len(chunks), batch_size)]
+    render = functools.partial(_render_group, noise_scale=noise_scale,
+        length_scale=length_scale, noise_scale_w=noise_scale_w)
+    if num_workers == 0:
+        if _net_g is None:
+            _init_worker(config_path, checkpoint_path, num_threads)
+        for group in groups:
+            for item in render(group):
+                yield item
+        return
+    with multiprocessing.Pool(num_workers, initializer=_init_worker,
+            initargs=(config_path, checkpoint_path, num_threads)) as pool:
+        # imap keeps text order, so the output can be written as it arrives
+        for rendered in pool.imap(render, groups):
+            for item in rendered:
+                yield item
+
+
+class WavJoiner:
+    """Writes chunks to a 16 bit mono wav as they come, separated by the
+    silence of the pause after the previous chunk. Chunk boundaries are faded
+    over crossfade seconds; without silence the two fades overlap."""
+    def __init__(self, path, sampling_rate, sentence_silence=0.3, clause_silence=0.1, crossfade=0.01, gain=1.0):
+        self.wav = wave.open(path, "wb")
+        self.wav.setnchannels(1)
+        self.wav.setsampwidth(2)
+        self.wav.setframerate(sampling_rate)
+        self.silence = {
+            "sentence": int(sentence_silence * sampling_rate),
+            "clause": int(clause_silence * sampling_rate),
+        }
+        self.fade = int(crossfade * sampling_rate)
+        self.gain = gain
+        self._tail = None
+        self._pause = None
+        self.num_samples = 0
+
+    def _write(self, x):
+        x = np.clip(x * self.gain, -1, 1) * 32767
+        self.wav.writeframes(x.astype("<i2").tobytes())
+        self.num_samples += len(x)
+
+    def add(self, audio, pause):
+        n = min(self.fade, len(audio) // 2)
+        head, body, tail = audio[:n], audio[n:len(audio)-n], audio[len(audio)-n:]
+        if self._tail is not None:
+            silence = self.silence[self._pause]
+            if silence > 0:
+                self._write(self._tail * np.linspace(1, 0, len(self._tail)))
+                self._write(np.zeros(silence))
+                self._write(head * np.linspace(0, 1, len(head)))
+            else:
+                m = min(len(self._tail), len(head))
+                self._write(self._tail[:len(self._tail)-m])
+                self._write(self._tail[len(self._tail)-m:] * np.linspace(1, 0, m) + head[:m] * np.linspace(0, 1, m))
+                self._write(head[m:])
+        else:
+            self._write(head)
+        self._write(body)
+        self._tail = tail
+        self._pause = pause
+
+    def close(self):
+        if self._tail is not None:
+            self._write(self._tail)
+        self.wav.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("text", nargs="?", default=None, help="text to read, or use --text_file")
+    parser.add_argument("--text_file", default=None)
+    parser.add_argument("-o", "--output", default="./vits_out/long.wav")
+    parser.add_argument("-c", "--config", default="../configs/tr_base.json")
+    parser.add_argument("-m", "--checkpoint", default="../logs/tr_base/latest.pth")
+    parser.add_argument("--max_chars", default=50, type=int, help="longest chunk in characters")
+    parser.add_argument("--batch_size", default=8, type=int)
+    parser.add_argument("--num_workers", default=0, type=int, help="0 renders in this process")
+    parser.add_argument("--num_threads", default=None, type=int, help="torch threads per process")
+    parser.add_argument("--sentence_silence", default=0.3, type=float, help="seconds")
+    parser.add_argument("--clause_silence", default=0.1, type=float, help="seconds")
+    parser.add_argument("--crossfade", default=0.01, type=float, help="seconds")
+    parser.add_argument("--gain", default=1.0, type=float)
+    parser.add_argument("--noise_scale", default=.667, type=float)
+    parser.add_argument("--length_scale", default=1, type=float)
+    parser.add_argument("--noise_scale_w", default=0.8, type=float)
+    args = parser.parse_args()
+
+    if args.text_file is not None:
+        with open(args.text_file) as f:
+            text = f.read()
+    elif args.text is not None:
+        text = args.text
+    else:
+        sys.stderr.write("Usage: long_text.py <text> | --text_file <file>\n")
+        sys.exit(1)
+
+    hps = utils.get_hparams_from_file(args.config)
+    chunks = text_to_chunks(text, hps, args.max_chars)
+    print("%d chunks" % len(chunks))
+
+    joiner = WavJoiner(args.output, hps.data.sampling_rate, args.sentence_silence,
+        args.clause_silence, args.crossfade, args.gain)
+    for i, (audio, pause) in enumerate(render_chunks(chunks, args.config, args.checkpoint,
+            args.batch_size, args.num_workers, args.num_threads,
+            args.noise_scale, args.length_scale, args.noise_scale_w)):
+        joiner.add(audio, pause)
+        print("%d/%d" % (i + 1, len(chunks)))
+    joiner.close()
+    print("%s: %.1f seconds" % (args.output, joiner.num_samples / hps.data.sampling_rate))
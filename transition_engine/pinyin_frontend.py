@@ -0,0 +1,53 @@
+"""
+Chinese text -> token ids in one pass, producing the same ids as
+
+    cleaned_text_to_sequence(convert_pinyin(remove_punctuation(text)))
+
+(plus commons.intersperse with add_blank) without building the pinyin string:
+punctuation goes through a single str.translate table, pypinyin runs once per
+string in TONE style and every syllable is mapped to its (initial, final) ids
+through a table filled on first use.
+"""
+import pypinyin
+from pypinyin.contrib.tone_convert import to_initials, to_finals_tone3
+
+import pinyin_symbols
+
+PUNCTUATION = "，。？、；：！“”‘’,.?;:!\"'"
+PUNCTUATION_TABLE = str.maketrans({c: " " for c in PUNCTUATION})
+
+_symbol_to_id = {s: i for i, s in enumerate(pinyin_symbols.pinyin_symbols)}
+
+
+def remove_punctuation(line):
+    return line.translate(PUNCTUATION_TABLE)
+
+
+class PinyinFrontend:
+    def __init__(self, add_blank=True):
+        self.add_blank = add_blank
+        # syllable in TONE style -> ids of its non empty initial and final
+        self._syllable_ids = {}
+
+    def _lookup(self, syllable):
+        ids = self._syllable_ids.get(syllable)
+        if ids is None:
+            initial = to_initials(syllable, strict=False)
+            final = to_finals_tone3(syllable, strict=True, neutral_tone_with_five=True)
+            # empty initials and finals are dropped, like the blanks in convert_pinyin
+            ids = tuple(_symbol_to_id[s] for s in (initial, final) if s != "")
+            self._syllable_ids[syllable] = ids
+        return ids
+
+    def __call__(self, line):
+        """Token ids of line as a list of ints, [0] with add_blank when it holds
+        no Chinese characters."""
+        line = line.translate(PUNCTUATION_TABLE)
+        ids = []
+        for syllable in pypinyin.lazy_pinyin(line, style=pypinyin.Style.TONE, errors="ignore"):
+            ids.extend(self._lookup(syllable))
+        if self.add_blank:
+            blanked = [0] * (len(ids) * 2 + 1)
+            blanked[1::2] = ids
+            return blanked
+        return ids
@@ -0,0 +1,134 @@
+import os
+import re
+import time
+import pickle
+import threading
+import collections
+import sys
+import unicodedata
+
+import torch
+
+from pinyin_frontend import PinyinFrontend
+
+sys.path.append('..')
+import commons
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """Cache key: NFKC (full width forms folded), surrounding whitespace
+    stripped and inner whitespace runs collapsed."""
+    text = unicodedata.normalize("NFKC", text)
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+_frontend = PinyinFrontend(add_blank=False)
+
+def text_to_ids(text, hps):
+    """Token ids of text, blank-interspersed when hps.data.add_blank is set,
+    empty when it holds no pinyin at all."""
+    ids = _frontend(text)
+    if not ids:
+        return torch.LongTensor([])
+    if hps.data.add_blank:
+        ids = commons.intersperse(ids, 0)
+    return torch.LongTensor(ids)
+
+
+class TextIdCache:
+    """Bounded LRU cache of text -> token ids (LongTensor) in front of the
+    pinyin conversion, with an optional time to live in seconds.
+    Safe to share between the threads of a server."""
+    def __init__(self, hps, maxsize=10000, ttl=None, convert=text_to_ids):
+        self.hps = hps
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.convert = convert
+        self._entries = collections.OrderedDict()  # key -> (ids, created)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, text):
+        key = normalize_text(text)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[1], now):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    # callers may modify the tensor they get, the cached one stays intact
+                    return entry[0].clone()
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+
+        # converted outside the lock, a concurrent miss on the same key only
+        # costs a duplicate conversion. The caller's text is converted, the
+        # normalized form is only the lookup key.
+        ids = self.convert(text, self.hps)
+        with self._lock:
+            self._entries[key] = (ids, now)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return ids.clone()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def save(self, path):
+        """Writes the live entries, least recently used first, atomically."""
+        now = time.time()
+        with self._lock:
+            entries = [(key, ids.tolist(), created) for key, (ids, created) in self._entries.items()
+                       if not self._expired(created, now)]
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    def load(self, path):
+        """Warms the cache from a file written by save(); expired entries are
+        skipped and the most recently used ones are kept if it is too large.
+        Returns the number of entries loaded."""
+        if not os.path.exists(path):
+            return 0
+        with open(path, "rb") as f:
+            entries = pickle.load(f)
+        now = time.time()
+        loaded = 0
+        with self._lock:
+            for key, ids, created in entries[-self.maxsize:]:
+                if self._expired(created, now):
+                    continue
+                self._entries[key] = (torch.LongTensor(ids), created)
+                self._entries.move_to_end(key)
+                loaded += 1
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return loaded
@@ -3,29 +3,29 @@ import contextlib
 import sys
 import wave
 import os
+import math
+import functools
+import multiprocessing
 
+import numpy as np
 import webrtcvad
+from scipy.signal import resample_poly
 
 CHANNELS = 1
 SAMPLE_WIDTH = 2
+# rates webrtcvad accepts, other wavs are resampled to VAD_RESAMPLE_RATE for detection
+VAD_SAMPLE_RATES = (8000, 16000, 32000, 48000)
+VAD_RESAMPLE_RATE = 16000
 
 def read_wave(path):
     """Reads a .wav file.
 
     Takes the path, and returns (PCM audio data, sample rate).
     """
-    with contextlib.closing(wave.open(path, 'rb')) as wf:
-        print("num_channels: %s, sample_width: %s, sample_rate: %s" % (wf.getnchannels(),
-                                                                       wf.getsampwidth(),
-                                                                       wf.getframerate())) 
-        num_channels = wf.getnchannels()
-        assert num_channels == CHANNELS
-        sample_width = wf.getsampwidth()
-        assert sample_width == SAMPLE_WIDTH
-        sample_rate = wf.getframerate()
-        assert sample_rate in (8000, 16000, 32000, 48000)
+    with contextlib.closing(open_wave(path)) as wf:
+        assert wf.getframerate() in VAD_SAMPLE_RATES
         pcm_data = wf.readframes(wf.getnframes())
-        return pcm_data, sample_rate
+        return pcm_data, wf.getframerate()
 
 
 def write_wave(path, audio, sample_rate):
@@ -41,11 +41,17 @@ def write_wave(path, audio, sample_rate):
 
 
 class Frame(object):
-    """Represents a "frame" of audio data."""
-    def __init__(self, bytes, timestamp, duration):
-        self.bytes = bytes
+    """Represents a "frame" of audio data by its byte offset in the audio
+    and its start time in seconds; the samples stay in the audio buffer."""
+    __slots__ = ("offset", "timestamp")
+
+    def __init__(self, offset, timestamp):
+        self.offset = offset
         self.timestamp = timestamp
-        self.duration = duration
+
+
+def frame_bytes(frame_duration_ms, sample_rate):
+    return int(sample_rate * (frame_duration_ms / 1000.0) * 2)
 
 
 def frame_generator(frame_duration_ms, audio, sample_rate):
@@ -54,93 +60,182 @@ def frame_generator(frame_duration_ms, audio, sample_rate):
     Takes the desired frame duration in milliseconds, the PCM data, and
     the sample rate.
 
-    Yields Frames of the requested duration.
+    Yields (Frame, memoryview of its samples) pairs of the requested duration.
     """
-    n = int(sample_rate * (frame_duration_ms / 1000.0) * 2)
+    n = frame_bytes(frame_duration_ms, sample_rate)
+    view = memoryview(audio)
     offset = 0
     timestamp = 0.0
     duration = (float(n) / sample_rate) / 2.0
     while offset + n < len(audio):
-        yield Frame(audio[offset:offset + n], timestamp, duration)
+        yield Frame(offset, timestamp), view[offset:offset + n]
         timestamp += duration
         offset += n
 
+def stream_frames(wf, frame_duration_ms, block_frames=1000):
+    """Generates audio frames from an open wave file, like frame_generator
+    over the whole file, reading block_frames frames at a time.
+
+    Frame offsets count from the start of the audio data; the samples are
+    memoryview slices of the current block.
+    """
+    sample_rate = wf.getframerate()
+    n = frame_bytes(frame_duration_ms, sample_rate)
+    total = wf.getnframes() * SAMPLE_WIDTH
+    offset = 0
+    timestamp = 0.0
+    duration = (float(n) / sample_rate) / 2.0
+    pending = b""
+    while offset + n < total:
+        data = wf.readframes(block_frames * n // SAMPLE_WIDTH)
+        if not data:
+            break
+        block = pending + data
+        view = memoryview(block)
+        start = 0
+        while start + n <= len(view) and offset + n < total:
+            yield Frame(offset, timestamp), view[start:start + n]
+            timestamp += duration
+            offset += n
+            start += n
+        pending = bytes(view[start:])
+
 # =========================================
 
 _V_INTERVAL_FRAME = 24
 _S_INTERVAL_FRAME = 33
-_keep = []
-_silence = []
-_voice_frames = []
 
-def _null_status(is_speech, frame):
-    global _keep
-    if is_speech == 0:
-        return "NULL"
-    if is_speech == 1:
-        _keep = []
-        _keep.append(frame)
-        return "PRE_V"
-    return "NULL"
 
-def _voice_status(is_speech, frame):
-    global _keep
-    global _silence
-    if is_speech == 1:
-        _keep.append(frame)
-        return "VOICE"
-    if is_speech == 0:
-        _keep.append(frame)
-        _silence = []
-        return "PRE_N"    
-    return "VOICE"
-
-def _pre_n_status(is_speech, frame):
-    global _keep
-    global _silence
-    global _voice_frames
-    if is_speech == 0:
-        _silence.append(frame)
-        _keep.append(frame)
-        if len(_silence) > _S_INTERVAL_FRAME:
-            _voice_frames.append(_keep)
-            _keep = []
+class VadSplitter(object):
+    """Splits audio into voiced segments with a NULL / PRE_V / VOICE / PRE_N
+    state machine: a segment opens after more than _V_INTERVAL_FRAME speech
+    frames in a row and closes after more than _S_INTERVAL_FRAME silent
+    frames. A segment still open at the end of the audio is dropped.
+
+    Frames are contiguous, so the kept frames are tracked as the offset of
+    the first one and a count, and segments come out as (start, end) byte
+    offsets. All state lives in the instance, one splitter per process.
+    """
+    def __init__(self, aggressiveness=0, frame_duration_ms=30):
+        self.vad = webrtcvad.Vad(aggressiveness)
+        self.frame_duration_ms = frame_duration_ms
+        self.reset()
+
+    def reset(self):
+        self._status = "NULL"
+        self._keep_start = 0
+        self._keep = 0
+        self._silence = 0
+        self.segments = []
+
+    def _null_status(self, is_speech, frame):
+        if is_speech == 0:
             return "NULL"
-        else:
+        if is_speech == 1:
+            self._keep_start = frame.offset
+            self._keep = 1
+            return "PRE_V"
+        return "NULL"
+
+    def _voice_status(self, is_speech, frame):
+        if is_speech == 1:
+            self._keep += 1
+            return "VOICE"
+        if is_speech == 0:
+            self._keep += 1
+            self._silence = 0
             return "PRE_N"
-    if is_speech == 1:
-        _keep.append(frame)
         return "VOICE"
-    
-    return "PRE_N"
-
-def _pre_v_status(is_speech, frame):
-    global _keep
-    if is_speech == 1:
-        _keep.append(frame)
-        if len(_keep) > _V_INTERVAL_FRAME:
+
+    def _pre_n_status(self, is_speech, frame, n):
+        if is_speech == 0:
+            self._silence += 1
+            self._keep += 1
+            if self._silence > _S_INTERVAL_FRAME:
+                self.segments.append((self._keep_start, frame.offset + n))
+                self._keep = 0
+                return "NULL"
+            else:
+                return "PRE_N"
+        if is_speech == 1:
+            self._keep += 1
             return "VOICE"
+        return "PRE_N"
+
+    def _pre_v_status(self, is_speech, frame):
+        if is_speech == 1:
+            self._keep += 1
+            if self._keep > _V_INTERVAL_FRAME:
+                return "VOICE"
+            else:
+                return "PRE_V"
+        if is_speech == 0:
+            self._keep = 0
+            return "NULL"
+        return "PRE_V"
+
+    def feed(self, frame, data, sample_rate):
+        is_speech = self.vad.is_speech(data, sample_rate)
+        if self._status == "NULL":
+            self._status = self._null_status(is_speech, frame)
+        elif self._status == "VOICE":
+            self._status = self._voice_status(is_speech, frame)
+        elif self._status == "PRE_V":
+            self._status = self._pre_v_status(is_speech, frame)
+        elif self._status == "PRE_N":
+            self._status = self._pre_n_status(is_speech, frame, len(data))
         else:
-            return "PRE_V"
-    if is_speech == 0:
-        _keep = []
-        return "NULL"
-    return "PRE_V"
+            print("ERROR _status: %s" % self._status)
+
+    def split(self, frames, sample_rate):
+        """Returns the voiced segments of (Frame, samples) pairs as (start, end)
+        byte offsets."""
+        self.reset()
+        for frame, data in frames:
+            self.feed(frame, data, sample_rate)
+        return self.segments
+
+    def split_file(self, path):
+        """Returns (segments, sample rate) of a wav file, streamed from disk.
+
+        Files at a rate webrtcvad does not support are read whole and resampled
+        to VAD_RESAMPLE_RATE for detection; the segment offsets are mapped back
+        to the file's own rate.
+        """
+        with contextlib.closing(open_wave(path)) as wf:
+            sample_rate = wf.getframerate()
+            if sample_rate in VAD_SAMPLE_RATES:
+                segments = self.split(stream_frames(wf, self.frame_duration_ms), sample_rate)
+                return segments, sample_rate
+            num_samples = wf.getnframes()
+            audio = np.frombuffer(wf.readframes(num_samples), dtype="<i2")
+
+        gcd = math.gcd(sample_rate, VAD_RESAMPLE_RATE)
+        audio = resample_poly(audio.astype(np.float32), VAD_RESAMPLE_RATE // gcd, sample_rate // gcd)
+        audio = np.clip(np.round(audio), -32768, 32767).astype("<i2").tobytes()
+        segments = self.split(frame_generator(self.frame_duration_ms, audio, VAD_RESAMPLE_RATE),
+                              VAD_RESAMPLE_RATE)
+
+        def to_source(offset):
+            sample = min(offset // SAMPLE_WIDTH * sample_rate // VAD_RESAMPLE_RATE, num_samples)
+            return sample * SAMPLE_WIDTH
+        return [(to_source(start), to_source(end)) for start, end in segments], sample_rate
+
+
+def open_wave(path):
+    """Opens a .wav file for reading after checking it is mono 16 bit PCM."""
+    wf = wave.open(path, 'rb')
+    print("num_channels: %s, sample_width: %s, sample_rate: %s" % (wf.getnchannels(),
+                                                                   wf.getsampwidth(),
+                                                                   wf.getframerate()))
+    assert wf.getnchannels() == CHANNELS
+    assert wf.getsampwidth() == SAMPLE_WIDTH
+    return wf
+
 
 def vad_dding(vad, frames, sample_rate):
-    _status = "NULL"
-    for frame in frames:
-        is_speech = vad.is_speech(frame.bytes, sample_rate)
-        if _status == "NULL":
-            _status = _null_status(is_speech, frame)
-        elif _status == "VOICE":
-            _status = _voice_status(is_speech, frame)
-        elif _status == "PRE_V":
-            _status = _pre_v_status(is_speech, frame)
-        elif _status == "PRE_N":
-            _status = _pre_n_status(is_speech, frame)
-        else:
-            print("ERROR _status: %s" % _status)
+    """Voiced (start, end) byte ranges of frames, vad being a VadSplitter."""
+    return vad.split(frames, sample_rate)
 
 def get_wave_files(wave_dir):
     files = os.listdir(wave_dir)
@@ -150,26 +245,38 @@ def get_wave_files(wave_dir):
     files = list(map(lambda f: os.path.join(wave_dir, f), files))
     return files
 
-def save_split_files(split_dir, file_name, framess, sample_rate):
+def save_split_files(split_dir, file_name, segments, sample_rate):
+    """Writes the (start, end) byte ranges of file_name to split_dir, reading
+    only those ranges back from the source file."""
     pre = file_name.split("/")[-1][:-4]
     i = 0
-    for frames in framess:
-        file_name = pre + "_%03d.wav" % i
-        print(file_name)
-        i += 1
-        dest = os.path.join(split_dir, file_name)
-        print(dest)
-        wave_data = b""
-        for frame in frames:
-            wave_data += frame.bytes
-        write_wave(dest, wave_data, sample_rate)
+    with contextlib.closing(wave.open(file_name, 'rb')) as wf:
+        for start, end in segments:
+            split_name = pre + "_%03d.wav" % i
+            print(split_name)
+            i += 1
+            dest = os.path.join(split_dir, split_name)
+            print(dest)
+            wf.setpos(start // SAMPLE_WIDTH)
+            write_wave(dest, wf.readframes((end - start) // SAMPLE_WIDTH), sample_rate)
     return
 
 
+_splitter = None
+
+def _split_and_save(wave_file, split_dir):
+    global _splitter
+    if _splitter is None:
+        _splitter = VadSplitter(0)
+    segments, sample_rate = _splitter.split_file(wave_file)
+    save_split_files(split_dir, wave_file, segments, sample_rate)
+    return wave_file, len(segments)
+
+
 def main(args):
-    if len(args) != 2:
+    if len(args) not in (2, 3):
         sys.stderr.write(
-            'Usage: example.py <dir to mono> <dir to data>\n')
+            'Usage: example.py <dir to mono> <dir to data> [num workers]\n')
         sys.exit(1)
 
     if not os.path.isdir(args[0]):
@@ -180,18 +287,13 @@ def main(args):
         sys.stderr.write('Not dir\n')
         sys.exit(1)
 
-    vad = webrtcvad.Vad(0)
+    num_workers = int(args[2]) if len(args) > 2 else os.cpu_count()
     wave_files = get_wave_files(args[0])
-    for wave_file in wave_files:
-        global _voice_frames
-        _voice_frames = []
-        audio, sample_rate = read_wave(wave_file)
-        frames = frame_generator(30, audio, sample_rate)
-        frames = list(frames)
-        vad_dding(vad, frames, sample_rate)
-        save_split_files(args[1], wave_file, _voice_frames, sample_rate)
-        print("frames: %s" % len(_voice_frames))
-    
+    with multiprocessing.Pool(num_workers) as pool:
+        split = functools.partial(_split_and_save, split_dir=args[1])
+        for wave_file, num_segments in pool.imap_unordered(split, wave_files):
+            print("%s frames: %s" % (wave_file, num_segments))
+
     # segments = vad_collector(sample_rate, 30, 300, vad, frames)
     # for i, segment in enumerate(segments):
     #     path = 'chunk-%002d.wav' % (i,)
@@ -34,20 +34,22 @@ def get_text_ids(phones, hps):
     text_norm = torch.LongTensor(text_norm)
     return text_norm
 
-#
-# define model and load checkpoint
-hps = utils.get_hparams_from_file("../configs/tr_base.json")
+def load_model(config_path="../configs/tr_base.json", checkpoint_path="../logs/tr_base/latest.pth"):
+    # define model and load checkpoint
+    hps = utils.get_hparams_from_file(config_path)
 
-net_g = SynthesizerTrn(
-    len(pinyin_symbols),
-    hps.data.filter_length // 2 + 1,
-    hps.train.segment_size // hps.data.hop_length,
-    **hps.model)
-_ = net_g.eval()
+    net_g = SynthesizerTrn(
+        len(pinyin_symbols),
+        hps.data.filter_length // 2 + 1,
+        hps.train.segment_size // hps.data.hop_length,
+        **hps.model)
+    _ = net_g.eval()
 
-_ = utils.load_checkpoint("../logs/tr_base/latest.pth", net_g, None)
+    _ = utils.load_checkpoint(checkpoint_path, net_g, None)
+    return hps, net_g
 
 if __name__ == "__main__":
+    hps, net_g = load_model()
     print("===============================================================")
     phonemes = chinese_to_phonemes(sys.argv[1])
     input_ids = get_text_ids(phonemes, hps)
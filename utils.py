@@ -2,11 +2,15 @@ import os
 import glob
 import sys
 import argparse
+import contextlib
 import logging
 import json
+import hashlib
+import math
 import subprocess
 import numpy as np
-from scipy.io.wavfile import read
+from scipy.io.wavfile import read, write
+from scipy.signal import resample_poly
 import torch
 
 MATPLOTLIB_FLAG = False
@@ -43,6 +47,20 @@ def load_checkpoint(checkpoint_path, model, optimizer=None):
   return model, optimizer, learning_rate, iteration
 
 
+def load_inference_checkpoint(checkpoint_path, model):
+  """Loads a checkpoint written by export_checkpoint.py. The model has to be a
+  SynthesizerTrn built with inference_only=True and remove_weight_norm() applied.
+  Half precision weights are cast to the dtype of the model.
+  """
+  assert os.path.isfile(checkpoint_path)
+  checkpoint_dict = torch.load(checkpoint_path, map_location='cpu')
+  model.load_state_dict(checkpoint_dict['model'])
+  iteration = checkpoint_dict['iteration']
+  logger.info("Loaded inference checkpoint '{}' (iteration {})".format(
+    checkpoint_path, iteration))
+  return model, iteration
+
+
 def save_checkpoint(model, optimizer, learning_rate, iteration, checkpoint_path):
   logger.info("Saving model and optimizer state at iteration {} to {}".format(
     iteration, checkpoint_path))
@@ -135,12 +153,124 @@ def load_wav_to_torch(full_path):
   return torch.FloatTensor(data.astype(np.float32)), sampling_rate
 
 
+def resample(audio, orig_sr, target_sr):
+  """Polyphase resampling with scipy's Kaiser windowed FIR along the last axis,
+  so a batch of equal length signals can go in one call. Returns float32."""
+  if orig_sr == target_sr:
+    return audio.astype(np.float32)
+  gcd = math.gcd(orig_sr, target_sr)
+  return resample_poly(audio, target_sr // gcd, orig_sr // gcd, axis=-1).astype(np.float32)
+
+
+def resampled_length(num_samples, orig_sr, target_sr):
+  """Length of resample() output for num_samples input samples."""
+  gcd = math.gcd(orig_sr, target_sr)
+  up, down = target_sr // gcd, orig_sr // gcd
+  return -(-num_samples * up // down)
+
+
+def resampled_path(full_path, sampling_rate):
+  return "{}.{}.wav".format(os.path.splitext(full_path)[0], sampling_rate)
+
+
+def load_wav_resampled(full_path, sampling_rate):
+  """load_wav_to_torch at sampling_rate. Wavs at another rate are resampled
+  once and cached next to the source as <name>.<rate>.wav (16 bit PCM)."""
+  try:
+    # only the header is parsed here, the samples are read when converted
+    orig_sr, data = read(full_path, mmap=True)
+  except ValueError:
+    # formats scipy cannot memory-map (24 bit)
+    orig_sr, data = read(full_path)
+  if orig_sr == sampling_rate:
+    return torch.FloatTensor(data.astype(np.float32)), sampling_rate
+  cached_path = resampled_path(full_path, sampling_rate)
+  if os.path.exists(cached_path):
+    return load_wav_to_torch(cached_path)
+  # multichannel wavs are (samples, channels), resample() works on the last axis
+  audio = resample(data.astype(np.float32).T, orig_sr, sampling_rate).T
+  # return what later reads of the cache will return
+  audio = np.ascontiguousarray(np.clip(np.round(audio), -32768, 32767).astype(np.int16))
+  tmp_path = "{}.{}.tmp".format(cached_path, os.getpid())
+  write(tmp_path, sampling_rate, audio)
+  os.replace(tmp_path, cached_path)
+  return torch.FloatTensor(audio.astype(np.float32)), sampling_rate
+
+
+def autocast(device, enabled=True):
+  """Mixed precision context for the training loops: fp16 torch.cuda.amp.autocast
+  on GPU, bf16 CPU autocast (torch >= 1.10) on CPU."""
+  if device.type == "cuda":
+    return torch.cuda.amp.autocast(enabled=enabled)
+  if hasattr(torch, "autocast"):
+    return torch.autocast("cpu", dtype=torch.bfloat16, enabled=enabled)
+  assert not enabled, "bf16 CPU autocast needs torch >= 1.10, set bf16_run to false."
+  return contextlib.nullcontext()
+
+
 def load_filepaths_and_text(filename, split="|"):
   with open(filename, encoding='utf-8') as f:
     filepaths_and_text = [line.strip().split(split) for line in f]
   return filepaths_and_text
 
 
+SPEC_CONFIG_KEYS = ["sampling_rate", "filter_length", "hop_length", "win_length", "max_wav_value"]
+
+
+def spec_config(hparams):
+  return {k: getattr(hparams, k) for k in SPEC_CONFIG_KEYS}
+
+
+def spec_config_hash(hparams):
+  config = json.dumps(spec_config(hparams), sort_keys=True)
+  return hashlib.sha1(config.encode("utf-8")).hexdigest()
+
+
+def spec_manifest_path(filelist):
+  return filelist + ".spec.json"
+
+
+def spec_cache_valid(filelist, hparams):
+  """False if the .spec.pt files of this filelist were built with other STFT parameters."""
+  manifest_path = spec_manifest_path(filelist)
+  if not os.path.exists(manifest_path):
+    return True
+  with open(manifest_path, "r") as f:
+    manifest = json.load(f)
+  return manifest["config_hash"] == spec_config_hash(hparams)
+
+
+def save_atomic(obj, path):
+  """torch.save to a temporary file and rename, so readers never see a partial file."""
+  tmp_path = "{}.{}.tmp".format(path, os.getpid())
+  torch.save(obj, tmp_path)
+  os.replace(tmp_path, path)
+
+
+def filelist_hash(filelist):
+  with open(filelist, "rb") as f:
+    return hashlib.sha1(f.read()).hexdigest()
+
+
+def length_index_path(filelist):
+  return filelist + ".lengths.npz"
+
+
+def load_length_index(filelist, hop_length):
+  """Spectrogram frame counts for every line of a filelist, in file order.
+  Returns None if there is no index or it was built for another filelist
+  content or hop_length (see build_length_index.py).
+  """
+  index_path = length_index_path(filelist)
+  if not os.path.exists(index_path):
+    return None
+  index = np.load(index_path)
+  if str(index["filelist_hash"]) != filelist_hash(filelist) or int(index["hop_length"]) != hop_length:
+    logger.warn("{} is out of date, falling back to file sizes.".format(index_path))
+    return None
+  return index["lengths"]
+
+
 def get_hparams(init=True):
   parser = argparse.ArgumentParser()
   parser.add_argument('-c', '--config', type=str, default="./configs/base.json",